@@ -5,18 +5,47 @@
 """
 
 import functools
+import importlib
 from typing import Callable
 
-from . import aa, deband, dehalo, fansub, mask, util  # noqa
 from ._metadata import __version__, __author__  # noqa
 
+# Submodules and aliases are imported on first access (PEP 562), so a script
+# that only needs `ssfunc.util` doesn't pull in every plugin wrapper's deps.
+_submodules = {
+    "aa",
+    "cache",
+    "deband",
+    "dehalo",
+    "dehardsub",
+    "fansub",
+    "mask",
+    "plugins",
+    "render",
+    "util",
+}
+
+_aliases = {
+    "masked_deband": ("deband", "masked_deband"),
+    "basedAA": ("aa", "basedAA"),
+    "src": ("util", "src"),
+    "lehmer": ("util", "lehmer_merge"),
+}
+
+_deprecated = {
+    "RetinexLinemask": ("mask", "retinex_linemask"),
+    "Blurred_Dehalo": ("dehalo", "blurred_dehalo"),
+    "Halocide": ("dehalo", "halocide"),
+    "MaskedDB": ("deband", "masked_deband"),
+}
+
 
 class EpisodeNotFound(Exception):
     def __str__(self):
         return "Unrecognised episode. Ping @SeaSmoke#0002"
 
 
-def __deprecate(old_name: str, func: Callable):
+def __deprecate(old_name: str, func: Callable) -> Callable:
     @functools.wraps(func)
     def deprecated(*args, **kwargs) -> Callable:
         print(
@@ -25,15 +54,27 @@ def __deprecate(old_name: str, func: Callable):
         )
         return func(*args, **kwargs)
 
-    globals().update({old_name: deprecated})
+    return deprecated
+
+
+def __getattr__(name: str):
+    if name in _submodules:
+        return importlib.import_module(f".{name}", __name__)
+
+    if name in _aliases:
+        module, attr = _aliases[name]
+        value = getattr(importlib.import_module(f".{module}", __name__), attr)
+    elif name in _deprecated:
+        module, attr = _deprecated[name]
+        value = __deprecate(
+            name, getattr(importlib.import_module(f".{module}", __name__), attr)
+        )
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
+    globals()[name] = value
+    return value
 
-__deprecate("RetinexLinemask", mask.retinex_linemask)
-__deprecate("Blurred_Dehalo", dehalo.blurred_dehalo)
-__deprecate("Halocide", dehalo.halocide)
-__deprecate("MaskedDB", deband.masked_deband)
 
-masked_deband = deband.masked_deband
-basedAA = aa.basedAA
-src = util.src
-lehmer = util.lehmer_merge
\ No newline at end of file
+def __dir__():
+    return sorted(set(globals()) | _submodules | set(_aliases) | set(_deprecated))
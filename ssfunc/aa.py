@@ -1,10 +1,12 @@
 import vapoursynth as vs
 
 from typing import Dict, Any
-from vsutil import depth, fallback, get_y, plane, join
+from vsutil import depth, fallback, get_depth, get_y, plane, join
 from nnedi3_rpow2 import nnedi3_rpow2
 from math import ceil
 
+from . import plugins
+
 core = vs.core
 
 shader = "FSRCNNX_x2_56-16-4-1.glsl"
@@ -16,9 +18,41 @@ def basedAA(
     mask_thr=60 << 8,
     fsrcnnx=False,
     shader=shader,
-    opencl=False,
+    opencl="auto",
+    skip_empty=True,
+    ranges=None,
+    tiles=None,
+    tile_pad=32,
     **eedi3override,
 ):
+    """
+    Supersampled EEDI3 anti-aliasing, limited to a binarized Prewitt edge mask.
+
+    Frames where the mask is empty (fades, black frames, flat title cards)
+    would come out unchanged, so with `skip_empty` they're passed straight
+    through without building the supersampled clip. `ranges` can further
+    limit the AA to the given frames/inclusive ranges; every other frame
+    is passed through as well. Both are served by a single FrameEval.
+
+    With `tiles` (a count, or a `(columns, rows)` tuple), the frame is split
+    into a grid of tiles, each padded by `tile_pad` pixels on every side for
+    the nnedi3/EEDI3 kernel support, and only tiles with mask coverage go
+    through the supersampling and EEDI3 passes. The AA'd tiles are stitched
+    back together and merged with the mask as usual.
+
+    :param clip:            Input clip
+    :param ssfac:           Supersampling factor
+    :param mask_thr:        Binarize threshold for the edge mask (16-bit)
+    :param fsrcnnx:         Use FSRCNNX instead of nnedi3_rpow2 for supersampling
+    :param shader:          Path to the FSRCNNX shader
+    :param opencl:          Use the OpenCL versions of EEDI3 and NNEDI3, "auto" uses them when available
+    :param skip_empty:      Pass through frames with an empty edge mask
+    :param ranges:          Only AA these frames/ranges
+    :param tiles:           Number of tiles, or `(columns, rows)`, for ROI mode
+    :param tile_pad:        Padding around every tile in ROI mode, in pixels
+    :param eedi3override:   Arguments to override the EEDI3 defaults with
+
+    """
     eedi3args: Dict[str, Any] = {
         "field": 0,
         "alpha": 0.125,
@@ -35,6 +69,9 @@ def basedAA(
 
     nnedi3args: Dict[str, Any] = dict(field=0, nsize=0, nns=4, qual=2)
 
+    if opencl == "auto":
+        opencl = plugins.has("eedi3m", "EEDI3CL") and plugins.has("nnedi3cl")
+
     def eedi3s(clip, sclip, mclip=None):
         out = (
             clip.eedi3m.EEDI3CL(sclip=sclip, **eedi3args)
@@ -62,40 +99,119 @@ def basedAA(
             mclip = mclip.resize.Point(iw * ceil(ow / iw), ih * ceil(oh / ih))
         return mclip.fmtc.resample(ow, oh, kernel="box", fulls=1, fulld=1)
 
-    clip = depth(clip, 16)
+    def supersample_aa(luma, mask):
+        aaw = round(luma.width * ssfac) >> 1 << 1
+        aah = round(luma.height * ssfac) >> 1 << 1
+        mclip = resize_mclip(mask, aaw, aah)
+        mclip_t = mclip.std.Transpose()
+
+        aa = luma.std.Transpose()
+
+        if fsrcnnx:
+            aa = get_y(
+                join([aa] * 3).placebo.Shader(
+                    shader=shader,
+                    filter="box",
+                    width=aa.width * 2,
+                    height=aa.height * 2,
+                )
+            )
+        else:
+            aa = nnedi3_rpow2(get_y(aa), rfactor=ssfac)
+
+        aa = aa.resize.Spline36(aah, aaw)
+
+        if opencl:
+            aa = eedi3s(aa, sclip=nnedi3s(aa)).std.Transpose()
+            aa = eedi3s(aa, sclip=nnedi3s(aa)).resize.Spline16(luma.width, luma.height)
+        else:
+            aa = eedi3s(aa, sclip=nnedi3s(aa), mclip=mclip_t).std.Transpose()
+            aa = eedi3s(aa, sclip=nnedi3s(aa), mclip=mclip).resize.Spline36(
+                luma.width, luma.height
+            )
 
-    aaw = round(clip.width * ssfac) >> 1 << 1
-    aah = round(clip.height * ssfac) >> 1 << 1
+        return aa
+
+    def tile_bounds(size, count):
+        bounds = [round(size * i / count) >> 1 << 1 for i in range(count)]
+        return list(zip(bounds, bounds[1:] + [size]))
+
+    def tiled_aa(luma, mask):
+        from functools import partial
+
+        def _tile(n, f, aa, src):
+            return aa if f.props["PlaneStatsMax"] > 0 else src
+
+        def crop(c, x0, y0, x1, y1):
+            return c.std.Crop(x0, c.width - x1, y0, c.height - y1)
+
+        cols, rows = tiles if isinstance(tiles, tuple) else (tiles, tiles)
+        out_rows = []
+        for y0, y1 in tile_bounds(luma.height, rows):
+            row = []
+            for x0, x1 in tile_bounds(luma.width, cols):
+                # pad the crop so the kernels see the same pixels as on the full frame
+                px0, px1 = max(x0 - tile_pad, 0), min(x1 + tile_pad, luma.width)
+                py0, py1 = max(y0 - tile_pad, 0), min(y1 + tile_pad, luma.height)
+
+                aa = supersample_aa(
+                    crop(luma, px0, py0, px1, py1), crop(mask, px0, py0, px1, py1)
+                )
+                aa = crop(aa, x0 - px0, y0 - py0, x1 - px0, y1 - py0)
+                src = crop(luma, x0, y0, x1, y1)
+                stats = crop(mask, x0, y0, x1, y1).std.PlaneStats()
+                row.append(
+                    src.std.FrameEval(partial(_tile, aa=aa, src=src), prop_src=stats)
+                )
+            out_rows.append(core.std.StackHorizontal(row))
+        return core.std.StackVertical(out_rows)
+
+    if get_depth(clip) != 16:
+        clip = depth(clip, 16)
+
+    # every form of the mask is derived from this native-size luma mask:
+    # the supersampled mask (and its transpose) in supersample_aa, the
+    # tile crops, the final merge and the empty-frame check
+    luma = get_y(clip)
     mask = (
-        clip.std.Prewitt()
+        luma.std.Prewitt()
         .std.Binarize(mask_thr)
         .std.Maximum()
         .std.BoxBlur(0, 1, 1, 1, 1)
     )
-    mclip = resize_mclip(mask, aaw, aah)
-    mclip = get_y(mclip)
-
-    aa = clip.std.Transpose()
 
-    if fsrcnnx:
-        aa = get_y(
-            join([aa] * 3).placebo.Shader(
-                shader=shader, filter="box", width=aa.width * 2, height=aa.height * 2
-            )
-        )
+    if tiles is not None:
+        aa = tiled_aa(luma, mask)
     else:
-        aa = nnedi3_rpow2(get_y(aa), rfactor=ssfac)
-
-    aa = aa.resize.Spline36(aah, aaw)
-
-    if opencl:
-        aa = eedi3s(aa, sclip=nnedi3s(aa)).std.Transpose()
-        aa = eedi3s(aa, sclip=nnedi3s(aa)).resize.Spline16(clip.width, clip.height)
-    else:
-        aa = eedi3s(aa, sclip=nnedi3s(aa), mclip=mclip.std.Transpose()).std.Transpose()
-        aa = eedi3s(aa, sclip=nnedi3s(aa), mclip=mclip).resize.Spline36(
-            clip.width, clip.height
+        aa = supersample_aa(luma, mask)
+    aa = luma.std.MaskedMerge(aa, mask)
+
+    if clip.format.color_family == vs.YUV:
+        aa = join([aa, plane(clip, 1), plane(clip, 2)], vs.YUV)
+
+    if not skip_empty and ranges is None:
+        return aa
+
+    from bisect import bisect_right
+    from functools import partial
+    from .util import normalise_ranges
+
+    if ranges is not None:
+        ranges = normalise_ranges(ranges, clip.num_frames, "basedAA")
+        starts = [start for start, _ in ranges]
+        ends = [end for _, end in ranges]
+
+    def _select(n: int, f: vs.VideoFrame = None, aa=None) -> vs.VideoNode:
+        if ranges is not None:
+            i = bisect_right(starts, n) - 1
+            if i < 0 or n > ends[i]:
+                return clip
+        if f is not None and f.props["PlaneStatsMax"] == 0:
+            return clip
+        return aa
+
+    if skip_empty:
+        return clip.std.FrameEval(
+            partial(_select, aa=aa), prop_src=mask.std.PlaneStats()
         )
-
-    aa = get_y(clip).std.MaskedMerge(aa, resize_mclip(mclip, clip.width, clip.height))
-    return join([aa, plane(clip, 1), plane(clip, 2)], vs.YUV)
+    return clip.std.FrameEval(partial(_select, aa=aa))
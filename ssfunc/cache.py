@@ -0,0 +1,375 @@
+import os
+import hashlib
+import vapoursynth as vs
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Union
+
+core = vs.core
+
+
+def cache_dir(*subdirs: str) -> str:
+    """
+    Returns (and creates) ssfunc's cache directory, or a subdirectory of it.
+    Defaults to `~/.cache/ssfunc`, can be overridden with `$SSFUNC_CACHE`.
+
+    :param subdirs:     Subdirectories to append
+    :rtype:             str
+
+    """
+    root = os.environ.get("SSFUNC_CACHE") or os.path.join(
+        os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "ssfunc"
+    )
+    path = os.path.join(root, *subdirs)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def file_key(path: str) -> str:
+    """
+    Cheap identity for a file on disk: absolute path, size and mtime.
+
+    :param path:    Path to file
+    :rtype:         str
+
+    """
+    st = os.stat(path)
+    return f"{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}"
+
+
+def content_key(path: str, chunk: int = 4 << 20) -> str:
+    """
+    Content hash of a file from its size and its first and last `chunk` bytes.
+    Unlike `file_key`, survives the file being moved, copied or touched.
+
+    :param path:    Path to file
+    :param chunk:   Number of bytes to read from each end
+    :rtype:         str
+
+    """
+    size = os.path.getsize(path)
+    h = hashlib.sha1(str(size).encode("utf-8"))
+    with open(path, "rb") as f:
+        h.update(f.read(chunk))
+        if size > chunk:
+            f.seek(max(size - chunk, chunk))
+            h.update(f.read(chunk))
+    return h.hexdigest()
+
+
+def clip_format_key(clip: vs.VideoNode) -> str:
+    """
+    Format, size and frame rate of a clip, the part of its identity that
+    changes every frame when it changes.
+
+    :param clip:    Input clip
+    :rtype:         str
+
+    """
+    fmt = clip.format.name if clip.format else "variable"
+    return f"{fmt}:{clip.width}x{clip.height}:{clip.fps_num}/{clip.fps_den}"
+
+
+def block_fingerprints(clip: vs.VideoNode, block: int = 500, num_frames: int = None):
+    """
+    Cheap per-block identity for a clip's content: the average, min and max
+    luma of a small thumbnail of the first frame of every `block` frames.
+    A trim or shift changes the fingerprints of every block after it, so
+    comparing them block by block finds where a clip was edited.
+
+    :param clip:        Input clip
+    :param block:       Block size, in frames
+    :param num_frames:  Number of frames to cover, defaults to the clip's length.
+                        Blocks past the end of the clip get a fingerprint of -1
+    :rtype:             numpy.ndarray
+    :returns:           Array of shape `(blocks, 3)`
+
+    """
+    import numpy as np
+
+    num_frames = clip.num_frames if num_frames is None else num_frames
+    samples = list(range(0, num_frames, block))
+    prints = np.full((len(samples), 3), -1.0)
+
+    small = core.std.ShufflePlanes(clip, 0, vs.GRAY).resize.Bilinear(
+        64, 36, format=vs.GRAY8
+    )
+    picks = [small[n] for n in samples if n < clip.num_frames]
+    if picks:
+        stats = (
+            picks[0] if len(picks) == 1 else core.std.Splice(picks)
+        ).std.PlaneStats()
+        for i, f in enumerate(stats.frames()):
+            prints[i] = [
+                f.props["PlaneStatsAverage"],
+                f.props["PlaneStatsMin"],
+                f.props["PlaneStatsMax"],
+            ]
+    return prints
+
+
+def index_file(path: str, ext: str) -> str:
+    """
+    Path of the index file for `path` inside the managed index cache,
+    `cache_dir("index")`.
+
+    :param path:    Path to source file
+    :param ext:     Index file extension, e.g. `lwi` or `ffindex`
+    :rtype:         str
+
+    """
+    return os.path.join(cache_dir("index"), f"{content_key(path)}.{ext}")
+
+
+class StatsCache:
+    """
+    Persistent per-frame store for a single frame prop, so that clip scans
+    can be resumed instead of decoding everything from frame 0 again.
+
+    The store is keyed by the source files (path, size and mtime), a
+    user-supplied `signature` describing the filter chain, and the prop name.
+    Values live in a memory-mapped NumPy array next to a "computed" bitmap,
+    both under `cache_dir("stats")`, and are flushed as they are computed so
+    an interrupted scan picks up where it stopped.
+
+    The filter chain can't be inspected from Python, so change `signature`
+    whenever the filtering changes. `open`/`values` also take a `key` for the
+    scanned clips' format (see `clip_format_key`): when it or the clip length
+    changes, every stored value is thrown away. They also take per-block
+    fingerprints (see `block_fingerprints`): only frames from the block
+    before the first changed fingerprint onwards are recomputed, so after a
+    trim at frame 8100 the frames up to the block before it are kept.
+    `invalidate(start)` does the same by hand.
+
+    :param sources:     Source file(s) the scanned clip is built from
+    :param signature:   String describing the filter chain
+    :param prop:        Frame prop to store
+
+    """
+
+    def __init__(
+        self,
+        sources: Union[str, List[str]],
+        signature: str = "",
+        prop: str = "PlaneStatsDiff",
+    ):
+        if isinstance(sources, str):
+            sources = [sources]
+
+        key = "\n".join([file_key(s) for s in sources] + [signature, prop])
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+        self.prop = prop
+        self.path = os.path.join(cache_dir("stats"), digest)
+        self.data = None
+        self.done = None
+        self.key = None
+        self.blocks = None
+
+    def _open_array(self, suffix: str, num_frames: int, dtype):
+        from numpy.lib.format import open_memmap
+
+        path = f"{self.path}.{suffix}.npy"
+        if os.path.exists(path):
+            old = open_memmap(path, mode="r+")
+            if old.shape == (num_frames,) and old.dtype == dtype:
+                return old
+            # the clip length changed, and a trim shifts every later frame,
+            # so nothing stored can be trusted
+            del old
+
+        return open_memmap(path, mode="w+", dtype=dtype, shape=(num_frames,))
+
+    def open(
+        self, num_frames: int, key: str = None, blocks=None, block: int = None
+    ) -> "StatsCache":
+        """
+        Opens (or creates) the backing arrays for a clip of `num_frames` frames.
+        If `key` differs from the one the values were stored under, they're
+        all thrown away. If `blocks`, one fingerprint row per `block` frames,
+        differs from the stored one, frames are invalidated from the block
+        before the first change, as the edit can be anywhere between the two
+        sampled frames.
+        """
+        import numpy as np
+
+        keyfile = f"{self.path}.key"
+        if key is not None and key != self.key:
+            stored = None
+            if os.path.exists(keyfile):
+                with open(keyfile) as f:
+                    stored = f.read()
+            if stored != key:
+                self.data = self.done = None
+                for suffix in ("values", "done", "blocks"):
+                    if os.path.exists(f"{self.path}.{suffix}.npy"):
+                        os.remove(f"{self.path}.{suffix}.npy")
+                with open(keyfile, "w") as f:
+                    f.write(key)
+            self.key = key
+
+        if self.data is None or len(self.data) != num_frames:
+            self.data = self._open_array("values", num_frames, np.dtype(np.float64))
+            self.done = self._open_array("done", num_frames, np.dtype(np.bool_))
+
+        if blocks is not None and (
+            self.blocks is None or not np.array_equal(self.blocks, blocks)
+        ):
+            self._check_blocks(np.asarray(blocks, dtype=np.float64), block)
+        return self
+
+    def _check_blocks(self, blocks, block: int):
+        import numpy as np
+
+        path = f"{self.path}.blocks.npy"
+        old = np.load(path) if os.path.exists(path) else None
+        if old is None or old.shape != blocks.shape:
+            self.invalidate()
+        else:
+            changed = np.flatnonzero(np.any(old != blocks, axis=1))
+            if len(changed):
+                self.invalidate(max(int(changed[0]) - 1, 0) * block)
+        np.save(path, blocks)
+        self.blocks = blocks
+
+    def get(self, n: int):
+        """
+        Returns the cached value for frame `n`, or None if it hasn't been computed.
+        """
+        return float(self.data[n]) if self.done[n] else None
+
+    def set(self, n: int, value: float):
+        self.data[n] = value
+        self.done[n] = True
+
+    def invalidate(self, start: int = 0, end: int = None):
+        """
+        Marks frames `start` to `end` (inclusive) as needing recomputation.
+        """
+        if self.done is not None:
+            self.done[start : None if end is None else end + 1] = False
+            self.flush()
+
+    def flush(self):
+        if self.data is not None:
+            self.data.flush()
+            self.done.flush()
+
+    def values(
+        self,
+        clip: vs.VideoNode,
+        start: int = 0,
+        end: int = None,
+        prefetch: int = None,
+        flush_every: int = 1000,
+        key: str = None,
+        blocks=None,
+        block: int = None,
+    ):
+        """
+        Returns the prop values of frames `start` to `end` (exclusive) of `clip`,
+        only requesting the frames that aren't in the cache yet.
+
+        :param clip:        Clip carrying `prop`
+        :param start:       First frame
+        :param end:         Last frame (exclusive), defaults to the end of the clip
+        :param prefetch:    Number of frames in flight, defaults to `core.num_threads`
+        :param flush_every: Flush to disk after this many new frames
+        :param key:         Format of the scanned clips, see `open`
+        :param blocks:      Per-block fingerprints of the scanned clips, see `open`
+        :param block:       Block size of `blocks`, in frames
+        :rtype:             numpy.ndarray
+
+        """
+        import numpy as np
+
+        self.open(clip.num_frames, key, blocks, block)
+        end = clip.num_frames if end is None else end
+
+        missing = np.flatnonzero(~self.done[start:end]) + start
+        if len(missing):
+            # split missing frames into contiguous runs
+            breaks = np.flatnonzero(np.diff(missing) != 1) + 1
+            count = 0
+            for run in np.split(missing, breaks):
+                s, e = int(run[0]), int(run[-1]) + 1
+                for i, f in enumerate(clip[s:e].frames(prefetch=prefetch), s):
+                    self.set(i, f.props[self.prop])
+                    count += 1
+                    if count % flush_every == 0:
+                        self.flush()
+            self.flush()
+
+        return np.array(self.data[start:end])
+
+
+class SourceCache:
+    """
+    Small LRU cache of source nodes, so loading the same file several times
+    in a script reuses one decoder instance and its frame cache.
+    Nodes are tied to the VapourSynth environment they were created in,
+    so the current environment is part of every key, and the nodes of
+    environments that have died (say after a vspreview or vsedit reload)
+    are dropped on the next `get`, instead of keeping their decoders open.
+
+    :param maxsize:     Maximum number of cached nodes
+
+    """
+
+    def __init__(self, maxsize: int = 16):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._nodes: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._envs: Dict[int, Any] = {}
+
+    def get(self, key: Hashable, loader: Callable[[], Any]):
+        """
+        Returns the node cached under `key`, calling `loader` to create it on a miss.
+        """
+        env = vs.get_current_environment()
+        self._drop_dead(env)
+        self._envs[env.env_id] = env
+
+        key = (env.env_id, key)
+        if key in self._nodes:
+            self.hits += 1
+            self._nodes.move_to_end(key)
+            return self._nodes[key]
+
+        self.misses += 1
+        node = loader()
+        self._nodes[key] = node
+        while len(self._nodes) > self.maxsize:
+            self._nodes.popitem(last=False)
+        return node
+
+    def _drop_dead(self, current):
+        """
+        Drops the nodes of every environment that isn't alive anymore. Without
+        `Environment.alive` (API3), only the current environment is kept.
+        """
+        for env_id, env in list(self._envs.items()):
+            if env_id == current.env_id:
+                continue
+            if not getattr(env, "alive", False):
+                del self._envs[env_id]
+                for key in [k for k in self._nodes if k[0] == env_id]:
+                    del self._nodes[key]
+
+    def clear(self):
+        """
+        Drops every cached node and resets the counters.
+        """
+        self._nodes.clear()
+        self._envs.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def __repr__(self) -> str:
+        return (
+            f"SourceCache(hits={self.hits}, misses={self.misses}, "
+            f"size={len(self)}, maxsize={self.maxsize})"
+        )
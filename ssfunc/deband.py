@@ -1,6 +1,8 @@
 import vapoursynth as vs
 from debandshit import dumb3kdb
-from vsutil import split, depth, get_depth, join
+from vsutil import depth, get_depth
+
+from . import plugins
 
 core = vs.core
 
@@ -9,16 +11,25 @@ def masked_deband(
     clip: vs.VideoNode,
     dmask: vs.VideoNode = None,
     output_depth: float = 16,
-    placebo: bool = True,
+    placebo: bool = "auto",
     chroma: bool = True,
     luma_args: dict = None,
     chroma_args: dict = None,
+    gate: bool = False,
+    gate_thr: float = 0.1,
+    sidecar: str = None,
 ) -> vs.VideoNode:
 
     """
-    Unified masked debanding wrapper for vapoursynth. Handles plane-splitting, bitdepth conversions, and masking.
+    Unified masked debanding wrapper for vapoursynth. Handles plane selection, bitdepth conversions, and masking.
     Currently supports Varde's dumb3kdb and vapoursynth-placebo. Support for GradFun3 and f3kbilateral is planned.
 
+    The whole clip is debanded in place using the plugins' own plane selection.
+    Clips below `output_depth` are converted to it first, so the smoothed
+    gradients aren't dithered back down, and clips whose depth the plugin
+    doesn't support are converted to 16-bit.
+    `dmask` protects the masked areas of the debanded planes in a single MaskedMerge.
+
     Dependencies:
 
     * vapoursynth-placebo
@@ -28,10 +39,14 @@ def masked_deband(
     :param clip: Input clip
     :param dmask: Mask clip
     :param output_depth: Output bitdepth
-    :param placebo: Use vapoursynth-placebo deband
+    :param placebo: Use vapoursynth-placebo deband, "auto" uses it when available
     :param chroma: Apply chroma deband
     :param luma_args: Arguments passed for luma deband
     :param chroma_args: Arguments passed for chroma deband
+    :param gate: Only deband frames whose `banding_scores` score is over `gate_thr`
+    :param gate_thr: Banding score threshold for `gate`
+    :param sidecar: File to cache the banding scores in, see `banding_scores`.
+        Without it, frames are scored lazily as they're requested
 
     :return: Debanded clip
 
@@ -43,38 +58,153 @@ def masked_deband(
 
     """
 
-    if get_depth(clip) != 16:
+    src = clip
+
+    if placebo == "auto":
+        placebo = plugins.has("placebo", "Deband")
+
+    if get_depth(clip) < output_depth:
+        clip = depth(clip, output_depth)
+
+    # placebo handles 8/16-bit integer and 32-bit float, f3kdb 8 to 16-bit integer
+    if clip.format.sample_type == vs.FLOAT:
+        supported = placebo and get_depth(clip) == 32
+    else:
+        supported = get_depth(clip) in ((8, 16) if placebo else range(8, 17))
+    if not supported:
         clip = depth(clip, 16)
 
-    planes = split(clip)
+    luma_only = not chroma or not placebo or clip.format.color_family == vs.GRAY
 
-    if placebo and chroma:
-        db = join(
-            [
-                core.placebo.Deband(planes[0], **luma_args),
-                core.placebo.Deband(planes[1], **chroma_args),
-                core.placebo.Deband(planes[2], **chroma_args),
-            ]
-        )
-    elif placebo:
-        deband_y = core.placebo.Deband(
-            planes[0], iterations=1, threshold=3, radius=16, grain=3
-        )
-        db = join([deband_y, planes[1], planes[2]])
+    if placebo:
+        if luma_args is None:
+            luma_args = dict(iterations=1, threshold=3, radius=16, grain=3)
+        db = core.placebo.Deband(clip, planes=1, **luma_args)
+        if not luma_only:
+            db = core.placebo.Deband(db, planes=2 | 4, **(chroma_args or {}))
     else:
-        deband_y = dumb3kdb(planes[0], **luma_args)
-        db = join([deband_y, planes[1], planes[2]])
+        # a threshold of 0 makes f3kdb leave the chroma planes untouched
+        luma_args = dict(luma_args or {})
+        threshold = luma_args.pop("threshold", 30)
+        grain = luma_args.pop("grain", 1)
+        if clip.format.color_family != vs.GRAY:
+            threshold = [threshold, 0, 0] if isinstance(threshold, int) else threshold
+            grain = [grain, 0] if isinstance(grain, int) else grain
+        db = dumb3kdb(clip, threshold=threshold, grain=grain, **luma_args)
 
     if dmask is not None:
-        if get_depth(dmask) == get_depth(db):
-            planes[0] = db.std.MaskedMerge(clip, dmask)
-        else:
-            dmask = depth(dmask, get_depth(deband_y))
-            planes[0] = db.std.MaskedMerge(clip, dmask)
-    else:
-        planes[0] = deband_y
+        if get_depth(dmask) != get_depth(db):
+            dmask = depth(dmask, get_depth(db))
+        db = db.std.MaskedMerge(
+            clip,
+            dmask,
+            planes=[0] if luma_only else [0, 1, 2],
+            first_plane=True,
+        )
 
-    if output_depth != 16:
-        return depth(db, output_depth)
-    else:
+    if get_depth(db) != output_depth:
+        db = depth(db, output_depth)
+
+    if not gate:
         return db
+
+    from functools import partial
+
+    passthrough = depth(src, output_depth) if get_depth(src) != output_depth else src
+
+    if sidecar is None:
+        # score every frame as it's requested, so evaluating the script stays cheap
+        def _route_lazy(n: int, f: vs.VideoFrame, db: vs.VideoNode) -> vs.VideoNode:
+            return db if f.props["PlaneStatsAverage"] > gate_thr else passthrough
+
+        return passthrough.std.FrameEval(
+            partial(_route_lazy, db=db), prop_src=_banding_stats(src)
+        )
+
+    scores = banding_scores(src, sidecar=sidecar)
+
+    def _route(n: int, db: vs.VideoNode) -> vs.VideoNode:
+        return db if scores[n] > gate_thr else passthrough
+
+    return passthrough.std.FrameEval(partial(_route, db=db))
+
+
+def _banding_stats(
+    clip: vs.VideoNode, downscale: int = 4, grad_thr: int = 2
+) -> vs.VideoNode:
+    """
+    Clip whose `PlaneStatsAverage` is the banding score of every frame.
+    """
+    from vsutil import get_y
+
+    small = get_y(clip).resize.Bilinear(
+        max(clip.width // downscale, 1),
+        max(clip.height // downscale, 1),
+        format=vs.GRAY8,
+    )
+    smooth = small.std.Sobel().std.Expr(f"x 0 > x {grad_thr} <= and 255 0 ?")
+    return smooth.std.PlaneStats()
+
+
+def banding_scores(
+    clip: vs.VideoNode,
+    downscale: int = 4,
+    grad_thr: int = 2,
+    sidecar: str = None,
+    prefetch: int = None,
+):
+    """
+    Cheap per-frame banding score, used by `masked_deband(gate=True)`.
+
+    The luma is downscaled and converted to 8-bit, and the score is the
+    fraction of pixels that sit on a smooth, non-flat gradient (Sobel
+    magnitude between 1 and `grad_thr`), which is where banding shows up.
+    Flat areas and detailed areas both score 0.
+
+    Frames are scanned in parallel. If `sidecar` is given, the scores are
+    saved to it (as a .npz file) and loaded from it on later runs, so the
+    threshold can be tuned and repeat encodes skip the scan. The sidecar
+    also records `downscale`, `grad_thr` and the clip's length, format and
+    block fingerprints, and the clip is scanned again if any of them differ,
+    so a sidecar copied from another episode is never reused.
+
+    :param clip: Input clip
+    :param downscale: Downscale factor for the luma
+    :param grad_thr: Largest 8-bit gradient still considered smooth
+    :param sidecar: Path to a .npz file to cache the scores in
+    :param prefetch: Number of frames in flight, defaults to `core.num_threads`
+
+    :return: Array of per-frame scores between 0 and 1
+    """
+    import os
+    import numpy as np
+    from .cache import block_fingerprints, clip_format_key
+
+    if sidecar is not None:
+        params = dict(
+            downscale=np.int64(downscale),
+            grad_thr=np.int64(grad_thr),
+            num_frames=np.int64(clip.num_frames),
+            format=np.str_(clip_format_key(clip)),
+            fingerprints=block_fingerprints(clip, 1000),
+        )
+        data = np.load(sidecar) if os.path.exists(sidecar) else None
+        # older sidecars are bare .npy arrays without any parameters
+        if isinstance(data, np.lib.npyio.NpzFile):
+            with data:
+                if all(
+                    k in data and np.array_equal(data[k], v) for k, v in params.items()
+                ):
+                    return data["scores"]
+
+    stats = _banding_stats(clip, downscale, grad_thr)
+
+    scores = np.empty(clip.num_frames, dtype=np.float32)
+    for i, f in enumerate(stats.frames(prefetch=prefetch)):
+        scores[i] = f.props["PlaneStatsAverage"]
+
+    if sidecar is not None:
+        with open(sidecar, "wb") as f:
+            np.savez(f, scores=scores, **params)
+
+    return scores
@@ -1,4 +1,7 @@
 import vapoursynth as vs
+from typing import List
+
+from . import plugins
 
 core = vs.core
 
@@ -11,7 +14,7 @@ def blurred_dehalo(
 
     """
     Bilateral-based dehalo function. Dehalos's white regions
-    using Bilateral blurring, and optionally dark lines using
+    using Bilateral blurring (BilateralGPU when available), and optionally dark lines using
     Gaussian blurring. Must be used with a mask. Intended for
     use with `ssfunc.dehalo.halocide`.
 
@@ -21,9 +24,9 @@ def blurred_dehalo(
 
     """
 
-    try:
+    if plugins.backend("bilateral") == ("bilateralgpu", "Bilateral"):
         blurLight = clip.bilateralgpu.Bilateral(sigmaB)
-    except:
+    else:
         blurLight = clip.bilateral.Bilateral(sigmaS=sigmaB)
 
     if sigmaG is not None:
@@ -37,44 +40,86 @@ def blurred_dehalo(
     return dehalo
 
 
+def _neighbours(var: str, radius: int) -> List[str]:
+    return [
+        f"{var}[{dx},{dy}]"
+        for dy in range(-radius, radius + 1)
+        for dx in range(-radius, radius + 1)
+    ]
+
+
+def _morph_expr(var: str, op: str, radius: int) -> str:
+    """
+    akarin.Expr snippet for the `op` ("max"/"min") of the square
+    neighbourhood of `var` with the given radius.
+    """
+    first, *rest = _neighbours(var, radius)
+    return " ".join([first] + [f"{t} {op}" for t in rest])
+
+
 def halocide(
     clip: vs.VideoNode = None, thmi: int = 164, thma: int = 256, **dehalo_args
 ) -> vs.VideoNode:
+    """
+    Masked dehalo using `blurred_dehalo`. The mask is built at the clip's own
+    bit depth; with akarin available, the arithmetic, the 5x5 min/max passes,
+    the line mask expansion and the blur are fused into a few akarin.Expr calls.
+    Thresholds are on an 8-bit scale regardless of the clip's depth.
+
+    :param clip:            Input clip
+    :param thmi:            Lower line mask threshold
+    :param thma:            Upper line mask threshold
+    :param dehalo_args:     Arguments passed to `blurred_dehalo`
 
+    """
     from vardefunc.mask import FDOG
-    from havsfunc import mt_expand_multi
-    from vsutil import iterate, get_depth, plane, depth
-    from util import scale
+    from vsutil import iterate, plane
 
     # Building Mask
 
-    if clip.format != vs.GRAY:
+    if clip.format.color_family != vs.GRAY:
         luma = plane(clip, 0)
     else:
         luma = clip
 
-    if get_depth(luma) != 8:
-        luma = depth(luma, 8)
+    if luma.format.sample_type == vs.FLOAT:
+        peak = 1.0
+    else:
+        peak = (1 << luma.format.bits_per_sample) - 1
 
-    peak = (1 << luma.format.bits_per_sample) - 1
+    # 8-bit constants scaled to the clip's range
+    lo = thmi * peak / 255
+    off = 8 * peak / 255
+    clamp = f"0 max {peak} min"
 
     linemask = FDOG().get_mask(luma)
-    edgemask = linemask.std.Expr(
-        expr=[f"x {scale(thmi, peak)} - {thma - thmi} / 255 *"]
-    )
-    xpand = mt_expand_multi(edgemask, sw=1, sh=1)
-
-    vEdge = core.std.Expr([luma, luma.std.Maximum().std.Maximum()], ["y x - 8 - 225 *"])
-    mask2 = iterate(vEdge, core.std.Maximum, 2)
-    mask2 = iterate(mask2, core.std.Minimum, 2)
-    mask2 = mask2.std.Convolution(matrix=[1, 2, 1, 2, 4, 2, 1, 2, 1])
-    mask = core.std.Expr([xpand, mask2], ["x y -"])
+    edge = f"{lo} - 255 * {thma - thmi} / {clamp}"
+
+    if plugins.has("akarin", "Expr"):
+        vEdge = core.akarin.Expr(
+            luma, f"{_morph_expr('x', 'max', 2)} x - {off} - 225 * {clamp}"
+        )
+        mask2 = core.akarin.Expr(vEdge, _morph_expr("x", "max", 2))
+        mask2 = core.akarin.Expr(mask2, _morph_expr("x", "min", 2))
+
+        weights = [1, 2, 1, 2, 4, 2, 1, 2, 1]
+        first, *rest = [f"{t} {w} *" for t, w in zip(_neighbours("y", 1), weights)]
+        blur = " ".join([first] + [f"{t} +" for t in rest]) + " 16 /"
+
+        mask = core.akarin.Expr(
+            [linemask, mask2],
+            f"{_morph_expr('x', 'max', 1)} {edge} {blur} - {clamp}",
+        )
+    else:
+        xpand = linemask.std.Maximum()
+        vEdge = core.std.Expr(
+            [luma, luma.std.Maximum().std.Maximum()], f"y x - {off} - 225 * {clamp}"
+        )
+        mask2 = iterate(vEdge, core.std.Maximum, 2)
+        mask2 = iterate(mask2, core.std.Minimum, 2)
+        mask2 = mask2.std.Convolution(matrix=[1, 2, 1, 2, 4, 2, 1, 2, 1])
+        mask = core.std.Expr([xpand, mask2], f"x {edge} y - {clamp}")
 
     dehalo = blurred_dehalo(clip, **dehalo_args)
 
-    if get_depth(clip) != 8:
-        dehalo_m = clip.std.MaskedMerge(dehalo, depth(mask, get_depth(clip)))
-    else:
-        dehalo_m = clip.std.MaskedMerge(dehalo, mask)
-
-    return dehalo_m
+    return clip.std.MaskedMerge(dehalo, mask)
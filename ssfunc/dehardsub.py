@@ -3,7 +3,7 @@ import vapoursynth as vs
 from lvsfunc.dehardsub import hardsub_mask
 from vstools import replace_ranges, FrameRangeN, FrameRangesN
 
-from typing import List
+from typing import List, Tuple
 
 core = vs.core
 
@@ -38,7 +38,6 @@ def dehardsub_signs(
     ranges: FrameRangeN | FrameRangesN | None = None,
     **kwargs,
 ):
-
     """
     Dehardsub wrapper for lvsfunc.dehardsub.hardsub_mask.
     Generates dehardsub mask using `ref` clip, falls back to `clean`
@@ -69,13 +68,16 @@ def dehardsub_fading_signs(
     ranges: List = [],
     **dehardsub_args,
 ) -> vs.VideoNode:
-
     """
     Dehardsub wrapper for lvsfunc.dehardsub.hardsub_mask.
     Uses the middle frame of the supplied range as the reference
     frame for generating the mask, and applies it to the whole
     range. This allows for clean dehardsubbing of static, fading signs.
 
+    Masks are generated once per range and frames are looked up in a
+    sorted range index through a single `FrameEval`, so the graph depth
+    doesn't grow with the number of ranges.
+
     :param hrdsb:               Hardsubbed source
     :param clean:               Clean source to dehardsub
     :param ref:                 Optional extra reference clip, mask will be
@@ -84,21 +86,214 @@ def dehardsub_fading_signs(
 
     :return:    Dehardsubbed clip
     """
+    from bisect import bisect_right
+    from functools import partial
     from .util import midval
 
     if ref is None:
         ref = clean
 
-    for r in ranges:
-        start, end = r
-        list = [*range(start, end + 1, 1)]
-        mid = midval(list)
+    if isinstance(ranges, tuple):
+        ranges = [ranges]
+
+    ranges = sorted(ranges)
+    for (_, prev_end), (start, end) in zip(ranges, ranges[1:]):
+        if start <= prev_end:
+            raise ValueError(
+                f"dehardsub_fading_signs: Overlapping ranges ending at {prev_end} "
+                f"and starting at {start}"
+            )
+
+    if not ranges:
+        return hrdsb
+
+    starts = [start for start, _ in ranges]
+    ends = [end for _, end in ranges]
 
+    merged = []
+    for r in ranges:
+        mid = midval(r)
         dehardsubmask = (
             hardsub_mask(hrdsb[mid], ref[mid], **dehardsub_args) * hrdsb.num_frames
         )
-        dehardsub_full = hrdsb.std.MaskedMerge(clean, dehardsubmask)
-        dehardsubbed = replace_ranges(hrdsb, dehardsub_full, [(start, end)])
-        hrdsb = dehardsubbed
+        merged.append(hrdsb.std.MaskedMerge(clean, dehardsubmask))
+
+    def _select(n: int, clips: List[vs.VideoNode]) -> vs.VideoNode:
+        i = bisect_right(starts, n) - 1
+        if i >= 0 and n <= ends[i]:
+            return clips[i]
+        return hrdsb
+
+    return hrdsb.std.FrameEval(partial(_select, clips=merged))
+
+
+def _runs(flags) -> List[Tuple[int, int]]:
+    """
+    Returns inclusive `(start, end)` runs of True values in a boolean array.
+    """
+    import numpy as np
+
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], flags.astype(np.int8), [0]))))
+    return [(int(s), int(e) - 1) for s, e in zip(edges[::2], edges[1::2])]
+
+
+def detect_signs(
+    hrdsb: vs.VideoNode,
+    ref: vs.VideoNode,
+    downscale: int = 4,
+    diff_thr: int = 24,
+    thr_hi: float = 0.002,
+    thr_lo: float = 0.0005,
+    min_length: int = 6,
+    max_gap: int = 2,
+    fade_ratio: float = 0.6,
+    sidecar: str = None,
+    prefetch: int = None,
+) -> Tuple[List[Tuple[int, int]], List[Tuple[int, int]]]:
+    """
+    Finds hardsubbed sign ranges by comparing `hrdsb` against a clean `ref`,
+    so they don't have to be found by scrubbing through the episode.
+
+    Both clips are downscaled, the 8-bit luma difference is binarized at
+    `diff_thr`, and the fraction of differing pixels is read with PlaneStats,
+    with many frames in flight. Frames go into a range once the coverage
+    goes over `thr_hi`, and the range continues while it stays over `thr_lo`.
+    Ranges closer than `max_gap` frames are joined, and ranges shorter
+    than `min_length` frames are dropped.
+
+    Ranges whose first and last frames cover less than `fade_ratio` of the
+    median coverage are classified as fading signs, for
+    `dehardsub_fading_signs`. The rest are returned as static signs, for
+    `dehardsub_signs`.
+
+    If `sidecar` is given, the per-frame coverage is saved to it as JSON
+    (next to the resulting ranges) and reused on later calls, so only the
+    scan is cached and the range thresholds can be tuned without rescanning.
+    The clips are scanned again if the sidecar was made with another
+    `downscale`/`diff_thr`, or from a clip with another length, format or
+    content.
+
+    Dialogue is hardsubbed too, so expect to prune the output.
+
+    :param hrdsb:       Hardsubbed clip
+    :param ref:         Clean reference clip
+    :param downscale:   Downscale factor for the diff
+    :param diff_thr:    8-bit luma difference for a pixel to count as changed
+    :param thr_hi:      Coverage needed to start a range
+    :param thr_lo:      Coverage needed to continue a range
+    :param min_length:  Minimum range length in frames
+    :param max_gap:     Largest gap in frames that is joined into one range
+    :param fade_ratio:  Edge/median coverage ratio below which a sign is fading
+    :param sidecar:     Path to a JSON file to cache the coverage in
+    :param prefetch:    Number of frames in flight, defaults to `core.num_threads`
+    :returns:           Static sign ranges and fading sign ranges
+    :rtype:             Tuple[FrameRangesN, FrameRangesN]
+
+    """
+    import json
+    import os
+    import numpy as np
+    from .cache import block_fingerprints, clip_format_key
+
+    scan = {
+        "num_frames": [hrdsb.num_frames, ref.num_frames],
+        "format": f"{clip_format_key(hrdsb)}|{clip_format_key(ref)}",
+        "fingerprints": block_fingerprints(hrdsb, 1000).tolist(),
+        "downscale": downscale,
+        "diff_thr": diff_thr,
+    }
+
+    coverage = None
+    if sidecar is not None and os.path.exists(sidecar):
+        with open(sidecar) as f:
+            data = json.load(f)
+        if all(data.get(k) == v for k, v in scan.items()) and "coverage" in data:
+            coverage = np.array(data["coverage"], dtype=np.float64)
+
+    if coverage is None:
+        coverage = _sign_coverage(hrdsb, ref, downscale, diff_thr, prefetch)
+
+    signs, fading = _classify_signs(
+        coverage, thr_hi, thr_lo, min_length, max_gap, fade_ratio
+    )
+
+    if sidecar is not None:
+        with open(sidecar, "w") as f:
+            json.dump(
+                dict(scan, signs=signs, fading=fading, coverage=coverage.tolist()), f
+            )
+
+    return signs, fading
+
+
+def _sign_coverage(
+    hrdsb: vs.VideoNode,
+    ref: vs.VideoNode,
+    downscale: int,
+    diff_thr: int,
+    prefetch: int = None,
+):
+    """
+    Per-frame fraction of pixels that differ between `hrdsb` and `ref`, for `detect_signs`.
+    """
+    import numpy as np
+    from vsutil import get_y
+
+    w = hrdsb.width // downscale >> 1 << 1
+    h = hrdsb.height // downscale >> 1 << 1
+
+    def _small(clip: vs.VideoNode) -> vs.VideoNode:
+        return get_y(clip).resize.Bilinear(w, h, format=vs.GRAY8)
+
+    diff = core.std.Expr(
+        [_small(hrdsb), _small(ref)], f"x y - abs {diff_thr} > 255 0 ?"
+    )
+    stats = diff.std.PlaneStats()
+
+    coverage = np.empty(stats.num_frames, dtype=np.float64)
+    for i, f in enumerate(stats.frames(prefetch=prefetch)):
+        coverage[i] = f.props["PlaneStatsAverage"]
+    return coverage
+
+
+def _classify_signs(
+    coverage,
+    thr_hi: float,
+    thr_lo: float,
+    min_length: int,
+    max_gap: int,
+    fade_ratio: float,
+) -> Tuple[List[Tuple[int, int]], List[Tuple[int, int]]]:
+    """
+    Turns per-frame coverage into static and fading sign ranges, for `detect_signs`.
+    """
+    import numpy as np
+
+    # hysteresis: keep low-threshold runs that reach the high threshold
+    ranges = [
+        (s, e)
+        for s, e in _runs(coverage > thr_lo)
+        if coverage[s : e + 1].max() > thr_hi
+    ]
+
+    joined: List[Tuple[int, int]] = []
+    for s, e in ranges:
+        if joined and s - joined[-1][1] - 1 <= max_gap:
+            joined[-1] = (joined[-1][0], e)
+        else:
+            joined.append((s, e))
+
+    signs: List[Tuple[int, int]] = []
+    fading: List[Tuple[int, int]] = []
+    for s, e in joined:
+        if e - s + 1 < min_length:
+            continue
+        cov = coverage[s : e + 1]
+        edge = max(1, len(cov) // 8)
+        med = np.median(cov)
+        if min(cov[:edge].mean(), cov[-edge:].mean()) < fade_ratio * med:
+            fading.append((s, e))
+        else:
+            signs.append((s, e))
 
-    return dehardsubbed
+    return signs, fading
@@ -1,7 +1,11 @@
 import ass
+from ass.section import LineSection
 import subdigest
 import subprocess
 import os
+import re
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 
 def dump_subs(subsfile: str, subsdata: subdigest.Subtitles):
@@ -23,94 +27,511 @@ def load_subs(subsfile: str):
     return subsdata
 
 
-def crunchy_unroll(infile: str = None, styles: str = None):
+def _ass_lines(f: Iterable[str]) -> Iterator[str]:
+    """
+    Stripped, non-empty, non-comment lines of an ASS file, as python-ass reads them.
+    """
+    for line in f:
+        line = line.strip()
+        if line and not line.startswith(";"):
+            yield line
+
+
+def _is_header(line: str) -> bool:
+    return line.startswith("[") and line.endswith("]")
+
 
+def _write_section(f, section):
+    for line in section.dump():
+        f.write(line)
+        f.write("\n")
+    f.write("\n")
+
+
+def _stream_events(lines: Iterator[str], sink: Callable[[str], None] = None):
     """
-    Restyles Crunchyroll subtitles using an external `styles` file.
+    Parses events from `lines` until the next section header, yielding them
+    one at a time. The current field order is passed to `sink` the first
+    time it's known, and the next section header (if any) is returned.
     """
-    from util import get_episode_number
+    from ass.section import EventsSection
 
-    if infile.endswith(".ass"):
-        print("Processing subtitles.")
-    elif infile.endswith(".mkv"):
-        print("Demuxing subtitles")
-        subprocess.run(["mkvextract", "-q", "tracks", infile, f"2:{infile}.ass"])
-        infile += ".ass"
-        print("Processing subtitles.")
+    field_order = EventsSection.field_order
+    told = False
 
-    subs = load_subs(infile)
+    for line in lines:
+        if _is_header(line):
+            if sink is not None and not told:
+                sink(field_order)
+            return line
+        if ":" not in line:
+            continue
+        type_name, _, raw = line.partition(":")
+        if type_name.lower() == "format":
+            field_order = [field.strip() for field in raw.split(",")]
+            continue
+        if sink is not None and not told:
+            sink(field_order)
+            told = True
+        parser = EventsSection.line_parsers.get(type_name.lower())
+        if parser is None:
+            raise ValueError(f"unexpected {type_name} line in Events")
+        yield parser.parse(type_name, raw.lstrip(), field_order), field_order
 
-    # Crunchyroll bad
-    subs.selection_set("style", "Top$")
-    subs.modify_field("text", "^", r"{\\an8}")
-    subs.modify_field("text", "}{", "")
+    if sink is not None and not told:
+        sink(field_order)
+    return None
+
+
+def iter_events(subsfile: str) -> Iterator:
+    """
+    Lazily parses the events of subsfile one at a time, without loading the
+    rest of the file into memory.
+    """
+    with open(subsfile, encoding="utf_8_sig") as f:
+        lines = _ass_lines(f)
+        for line in lines:
+            if line.lower() == "[events]":
+                for event, _ in _stream_events(lines):
+                    yield event
+                return
 
-    subs.selection_set("style", "^Italics")
-    subs.modify_field("text", "^", r"{\\i1}")
-    subs.modify_field("text", "}{", "")
 
-    subs.selection_set("style", "^Main")
-    subs.modify_field("style", "^.*", "Dialogue")
+def stream_subs(
+    infile: str,
+    outfile: str,
+    transforms: List[Callable] = None,
+    header: Callable[[subdigest.Subtitles], None] = None,
+    buffer_size: int = 1 << 20,
+):
+    """
+    Streaming version of `load_subs` + `dump_subs` for very large files.
+    Sections before the events are small, so they're parsed normally and
+    passed to `header` as a subdigest object with no events (so don't call
+    `use_styles` on it). Events are then parsed, run through every function
+    in `transforms` (which return the event, or None to drop it) and written
+    one at a time through a buffered writer. Sections after the events are
+    read and written one at a time. Memory use doesn't grow with file size.
+    """
+    transforms = transforms or []
 
-    subs.selection_set("style", "^Flashback")
-    subs.modify_field("style", "^.*", "Flashback")
+    with open(infile, encoding="utf_8_sig") as src, open(
+        outfile, "w", encoding="utf_8_sig", buffering=buffer_size
+    ) as out:
+        lines = _ass_lines(src)
 
-    subs.selection_set("style", "Top$")
-    subs.modify_field("style", "^.*", "Alt")
+        head = []
+        found = False
+        for line in lines:
+            if line.lower() == "[events]":
+                found = True
+                break
+            head.append(line)
 
-    subs.selection_set("style", "^Italics")
-    subs.modify_field("style", "^.*", "Dialogue")
+        doc = ass.parse(head)
+        subs = subdigest.Subtitles(doc, infile)
+        if header is not None:
+            header(subs)
 
-    # nuke \N tags
-    subs.modify_field("text", r"\s*{\\i0}\s*\\N\s*{\\i1}\s*", " ")
-    subs.modify_field("text", r"\s*\\[Nn]\s*", " ")
-    subs.modify_field("text", r"\s*\\[Nn]", " ")
-    subs.modify_field("text", r"\\[Nn]\s*", " ")
-    subs.modify_field("text", r"\\[Nn]", " ")
+        if not found:
+            for section in doc.sections.values():
+                _write_section(out, section)
+            return
 
-    # misc
-    subs.modify_field("text", "--", "—")
-    subs.use_styles()
-    subs.set_script_info("YCbCr Matrix", "TV.709")
-    subs.set_script_info("Script Updated By", "SeaSmoke")
+        for name, section in doc.sections.items():
+            if name.lower() != EVENTS.lower():
+                _write_section(out, section)
 
-    # dump subs to temp file
-    ep = get_episode_number(infile)
-    temp = f"{ep}_temp.ass"
-    dump_subs(temp, subs)
+        def write_format(field_order):
+            out.write(f"[{EVENTS}]\nFormat: {', '.join(field_order)}\n")
 
-    # Loading video for resampling
-    video = infile.replace(".ass", "")
+        events = _stream_events(lines, write_format)
+        while True:
+            try:
+                event, field_order = next(events)
+            except StopIteration as stop:
+                next_header = stop.value
+                break
+            for transform in transforms:
+                event = transform(event)
+                if event is None:
+                    break
+            else:
+                out.write(event.dump_with_type(field_order))
+                out.write("\n")
+        out.write("\n")
 
-    # Resampling subs using aegisub-cli
-    subprocess.run(["aegisub-cli", "--video", video, temp, temp, "tool/resampleres"])
+        # trailing sections (fonts, extradata, ...), one at a time
+        while next_header is not None:
+            name = next_header[1:-1]
+            section = ass.document.Document.SECTIONS.get(name, LineSection)(name)
+            next_header = None
+            for line in lines:
+                if _is_header(line):
+                    next_header = line
+                    break
+                if ":" in line:
+                    type_name, _, raw = line.partition(":")
+                    section.add_line(type_name, raw.lstrip())
+            _write_section(out, section)
 
-    # Copying styles from `styles` using prass
-    subprocess.run(
-        [
-            "python",
-            "-m",
-            "prass",
-            "copy-styles",
-            "--from",
-            styles,
-            "--to",
-            temp,
-            "-o",
-            temp,
+
+STYLES = "V4+ Styles"
+EVENTS = "Events"
+INFO = "Script Info"
+
+_coord_tag = re.compile(r"\\(pos|org|move|i?clip)\(([^)]*)\)")
+_size_tag = re.compile(
+    r"\\(fsp|fs|xbord|ybord|bord|xshad|yshad|shad|blur|pbo)(-?[0-9.]+)"
+)
+_drawing_number = re.compile(r"-?[0-9.]+")
+_override_block = re.compile(r"(\{[^}]*\})")
+_drawing_tag = re.compile(r"\\p([0-9]+)")
+
+
+def _fmt(value: float) -> str:
+    return f"{value:.3f}".rstrip("0").rstrip(".")
+
+
+def _scale_drawing(drawing: str, rx: float, ry: float) -> str:
+    coords = iter([rx, ry] * len(drawing))
+    return _drawing_number.sub(
+        lambda m: _fmt(float(m.group(0)) * next(coords)), drawing
+    )
+
+
+def _scale_drawings(text: str, rx: float, ry: float) -> str:
+    """
+    Scales the drawing commands in the `\\pN` (N > 0) parts of an event's text.
+    """
+    parts = _override_block.split(text)
+    drawing = False
+    for i, part in enumerate(parts):
+        if i % 2:
+            levels = _drawing_tag.findall(part)
+            if levels:
+                drawing = int(levels[-1]) > 0
+        elif drawing and part:
+            parts[i] = _scale_drawing(part, rx, ry)
+    return "".join(parts)
+
+
+def _scale_tags(text: str, rx: float, ry: float) -> str:
+    """
+    Scales positioning and size override tags, and drawings, in an event's text.
+    """
+
+    def coords(m):
+        tag, args = m.group(1), m.group(2).split(",")
+        if tag in ("pos", "org"):
+            count = 2
+        elif tag == "move":
+            count = 4
+        elif len(args) == 4:
+            count = 4
+        else:
+            # vector clip, optionally with a leading scale argument
+            args[-1] = _scale_drawing(args[-1], rx, ry)
+            return f"\\{tag}({','.join(args)})"
+        args[:count] = [
+            _fmt(float(v) * (rx if i % 2 == 0 else ry))
+            for i, v in enumerate(args[:count])
         ]
+        return f"\\{tag}({','.join(a.strip() for a in args)})"
+
+    def sizes(m):
+        tag = m.group(1)
+        factor = rx if tag in ("fsp", "xbord", "xshad") else ry
+        return f"\\{tag}{_fmt(float(m.group(2)) * factor)}"
+
+    if "\\" not in text:
+        return text
+    text = _size_tag.sub(sizes, _coord_tag.sub(coords, text))
+    if _drawing_tag.search(text):
+        text = _scale_drawings(text, rx, ry)
+    return text
+
+
+def _resample_style(style, rx: float, ry: float):
+    style.fontsize = float(_fmt(style.fontsize * ry))
+    style.spacing = float(_fmt(style.spacing * rx))
+    style.outline = float(_fmt(style.outline * ry))
+    style.shadow = float(_fmt(style.shadow * ry))
+    style.margin_l = round(style.margin_l * rx)
+    style.margin_r = round(style.margin_r * rx)
+    style.margin_v = round(style.margin_v * ry)
+    if rx != ry:
+        # stretch horizontally when the aspect ratio changes
+        style.scale_x = float(_fmt(style.scale_x * rx / ry))
+
+
+def _play_res(info) -> Tuple[int, int]:
+    x = int(info.get("PlayResX", 0) or 0)
+    y = int(info.get("PlayResY", 0) or 0)
+    # same defaults as libass/Aegisub when only one or neither is set
+    if not x and not y:
+        return 384, 288
+    if not y:
+        return x, 1024 if x == 1280 else x * 3 // 4
+    if not x:
+        return 1280 if y == 1024 else y * 4 // 3, y
+    return x, y
+
+
+def resample_subs(subs: subdigest.Subtitles, width: int, height: int):
+    """
+    Resamples subtitles to a new PlayResX/PlayResY in place, scaling styles,
+    event margins, positioning/size override tags and drawings. In-process
+    replacement for Aegisub's "Resample Resolution" tool.
+    """
+    info = subs.sections[INFO]
+    src_x, src_y = _play_res(info)
+    rx, ry = width / src_x, height / src_y
+
+    info["PlayResX"] = str(width)
+    info["PlayResY"] = str(height)
+    if rx == 1 and ry == 1:
+        return
+
+    for style in subs.sections[STYLES]:
+        _resample_style(style, rx, ry)
+
+    for event in subs.sections[EVENTS]:
+        event.margin_l = round(event.margin_l * rx)
+        event.margin_r = round(event.margin_r * rx)
+        event.margin_v = round(event.margin_v * ry)
+        event.text = _scale_tags(event.text, rx, ry)
+
+
+def copy_styles(subs: subdigest.Subtitles, stylesfile: str, resample: bool = True):
+    """
+    Copies styles from `stylesfile` into subs in place, replacing styles with
+    the same name and appending new ones. Styles are resampled to the target's
+    resolution first, like `prass copy-styles`.
+    """
+    with open(stylesfile, encoding="utf_8_sig") as f:
+        source = ass.parse(f)
+
+    new_styles = list(source.sections[STYLES])
+    if resample:
+        src_x, src_y = _play_res(source.sections[INFO])
+        dst_x, dst_y = _play_res(subs.sections[INFO])
+        if (src_x, src_y) != (dst_x, dst_y):
+            for style in new_styles:
+                _resample_style(style, dst_x / src_x, dst_y / src_y)
+
+    styles = subs.sections[STYLES]
+    index = {style.name: i for i, style in enumerate(styles)}
+    for style in new_styles:
+        if style.name in index:
+            styles[index[style.name]] = style
+        else:
+            styles.append(style)
+
+
+Rule = Tuple[Optional[Tuple[str, str]], str, str, str]
+
+# the fixups crunchy_unroll used to make with selection_set/modify_field
+CRUNCHY_RULES: List[Rule] = [
+    (("style", "Top$"), "text", "^", r"{\\an8}"),
+    (("style", "Top$"), "text", "}{", ""),
+    (("style", "^Italics"), "text", "^", r"{\\i1}"),
+    (("style", "^Italics"), "text", "}{", ""),
+    (("style", "^Main"), "style", "^.*", "Dialogue"),
+    (("style", "^Flashback"), "style", "^.*", "Flashback"),
+    (("style", "Top$"), "style", "^.*", "Alt"),
+    (("style", "^Italics"), "style", "^.*", "Dialogue"),
+    # nuke \N tags
+    (("style", "^Italics"), "text", r"\s*{\\i0}\s*\\N\s*{\\i1}\s*", " "),
+    (("style", "^Italics"), "text", r"\s*\\[Nn]\s*", " "),
+    (("style", "^Italics"), "text", r"\s*\\[Nn]", " "),
+    (("style", "^Italics"), "text", r"\\[Nn]\s*", " "),
+    (("style", "^Italics"), "text", r"\\[Nn]", " "),
+    # misc
+    (("style", "^Italics"), "text", "--", "—"),
+]
+
+
+@lru_cache(maxsize=32)
+def compile_rules(rules: Tuple[Rule, ...]):
+    """
+    Precompiles an ordered tuple of `(selector, field, pattern, replacement)`
+    rewrite rules for `apply_rules`. `selector` is a `(field, pattern)` pair,
+    or None for every event.
+
+    Like a `selection_set` followed by `modify_field` calls, consecutive rules
+    with the same selector share one selection, made before the first of them
+    runs. Consecutive rules on the same field get a combined alternation of
+    their patterns, which is used to skip the whole run for values none of
+    them match.
+    """
+    groups = []
+    for selector, field, pattern, repl in rules:
+        if not groups or groups[-1][0] != selector:
+            sel = None if selector is None else (selector[0], re.compile(selector[1]))
+            groups.append((selector, sel, []))
+        runs = groups[-1][2]
+        if not runs or runs[-1][0] != field:
+            runs.append((field, [], []))
+        runs[-1][1].append(pattern)
+        runs[-1][2].append((re.compile(pattern), repl))
+
+    compiled = []
+    for _, sel, runs in groups:
+        out = []
+        for field, patterns, subs in runs:
+            try:
+                gate = re.compile("|".join(f"(?:{p})" for p in patterns))
+            except re.error:
+                gate = None
+            out.append((field, gate, subs))
+        compiled.append((sel, out))
+    return compiled
+
+
+def _rule_plan(compiled, values: Dict[str, str]):
+    """
+    Runs the rules on the selector fields alone. Selections only depend on
+    those fields, and rules only read the field they rewrite, so this gives
+    the final selector values and the runs left to apply to the other fields
+    for every event that starts with the same selector values.
+    """
+    values = dict(values)
+    runs = []
+    for sel, group in compiled:
+        if sel is not None and not sel[1].search(values[sel[0]]):
+            continue
+        for field, gate, regexes in group:
+            if field in values:
+                for regex, repl in regexes:
+                    values[field] = regex.sub(repl, values[field])
+            else:
+                runs.append((field, gate, regexes))
+    return values, runs
+
+
+def apply_rules(subs: subdigest.Subtitles, rules: List[Rule]):
+    """
+    Applies rewrite rules (see `compile_rules`) to every event in a single
+    pass. The output is the same as running the equivalent
+    `selection_set`/`modify_field` calls one after another.
+    """
+    compiled = compile_rules(tuple(rules))
+    sel_fields = sorted({sel[0] for sel, _ in compiled if sel is not None})
+
+    # selectors mostly look at styles, which repeat, so plan once per value
+    plans = {}
+
+    for event in subs.sections[EVENTS]:
+        key = tuple(getattr(event, field) for field in sel_fields)
+        plan = plans.get(key)
+        if plan is None:
+            plan = plans[key] = _rule_plan(compiled, dict(zip(sel_fields, key)))
+        final, runs = plan
+
+        for field, old in zip(sel_fields, key):
+            if final[field] != old:
+                setattr(event, field, final[field])
+
+        for field, gate, regexes in runs:
+            value = getattr(event, field)
+            if gate is not None and not gate.search(value):
+                continue
+            for regex, repl in regexes:
+                value = regex.sub(repl, value)
+            setattr(event, field, value)
+
+
+_io_slots = None
+
+
+def _init_io_slots(slots):
+    global _io_slots
+    _io_slots = slots
+
+
+def _run_io(cmd: List[str]):
+    """
+    Runs an I/O-heavy external command, waiting for a free slot in batch mode.
+    """
+    if _io_slots is None:
+        return subprocess.run(cmd)
+    with _io_slots:
+        return subprocess.run(cmd)
+
+
+def video_resolution(video: str) -> Tuple[int, int]:
+    """
+    Returns the resolution of the first video track of a file, using `mkvmerge -J`.
+    """
+    import json
+
+    proc = subprocess.run(
+        ["mkvmerge", "-J", video], capture_output=True, text=True, check=True
     )
+    for track in json.loads(proc.stdout).get("tracks", []):
+        dimensions = track.get("properties", {}).get("pixel_dimensions")
+        if track.get("type") == "video" and dimensions:
+            width, height = dimensions.split("x")
+            return int(width), int(height)
+    raise ValueError(f"video_resolution: no video track found in {video}")
+
+
+def crunchy_unroll(
+    infile: str = None,
+    styles: str = None,
+    resolution: Tuple[int, int] = None,
+    workdir: str = None,
+):
+    """
+    Restyles Crunchyroll subtitles using an external `styles` file.
+    Subtitles are resampled to `resolution` (the video's own by default)
+    and restyled in memory, the only external processes are the demux,
+    the resolution probe and the final mux.
+    Intermediate subtitle files are written to `workdir` if given,
+    next to the input otherwise.
+    """
+    if infile.endswith(".ass"):
+        print("Processing subtitles.")
+        video = infile.replace(".ass", "")
+    elif infile.endswith(".mkv"):
+        print("Demuxing subtitles")
+        video = infile
+        if workdir is None:
+            infile = f"{video}.ass"
+        else:
+            infile = os.path.join(workdir, f"{os.path.basename(video)}.ass")
+        _run_io(["mkvextract", "-q", "tracks", video, f"2:{infile}"])
+        print("Processing subtitles.")
+
+    fixed = infile.replace(".ass", "_fixed.ass")
+    if workdir is not None:
+        fixed = os.path.join(workdir, os.path.basename(fixed))
+
+    if resolution is None:
+        resolution = video_resolution(video)
+
+    subs = load_subs(infile)
+
+    # Crunchyroll bad
+    apply_rules(subs, CRUNCHY_RULES)
+    subs.use_styles()
+    subs.set_script_info("YCbCr Matrix", "TV.709")
+    subs.set_script_info("Script Updated By", "SeaSmoke")
+
+    # Resampling subs and copying styles from `styles`
+    resample_subs(subs, *resolution)
+    copy_styles(subs, styles)
 
     # export subs file
-    subs = load_subs(temp)
-    dump_subs(infile.replace(".ass", "_fixed.ass"), subs)
+    dump_subs(fixed, subs)
 
     # mux subs back into video
-    subprocess.run(
+    _run_io(
         [
             "mkvmerge",
             "-o",
-            infile.replace(".ass", "").replace(".mkv", "_fixed.mkv"),
+            video.replace(".mkv", "_fixed.mkv"),
             "-S",
             "-A",
             "--language",
@@ -127,13 +548,97 @@ def crunchy_unroll(infile: str = None, styles: str = None):
             "0:en",
             "--track-name",
             "0:[Smoke]",
-            infile.replace(".ass", "_fixed.ass"),
+            fixed,
         ]
     )
 
     # Removing temporary files
-    os.remove(temp)
     os.remove(infile)
-    os.remove(infile.replace(".ass", "_fixed.ass"))
+    os.remove(fixed)
 
     print("Done!")
+
+
+def _unroll_episode(
+    infile: str, styles: str, resolution: Tuple[int, int], episode: str
+) -> Dict:
+    import tempfile
+    from time import perf_counter
+
+    result = dict(file=infile, episode=episode, ok=True, error=None)
+    t0 = perf_counter()
+    try:
+        with tempfile.TemporaryDirectory(prefix=f"ssfunc_{episode}_") as workdir:
+            crunchy_unroll(infile, styles, resolution, workdir=workdir)
+    except Exception as e:
+        result.update(ok=False, error=f"{type(e).__name__}: {e}")
+    result["seconds"] = perf_counter() - t0
+    return result
+
+
+def crunchy_unroll_batch(
+    source: str,
+    styles: str = None,
+    workers: int = None,
+    io_jobs: int = 2,
+    resolution: Tuple[int, int] = None,
+) -> List[Dict]:
+    """
+    Runs `crunchy_unroll` on a whole season in parallel worker processes.
+    `source` is either a directory (every .mkv in it is processed) or a glob.
+    Outputs of earlier runs (`*_fixed.mkv`) are skipped, and files without
+    an episode number are reported as failed instead of processed.
+    Every episode gets its own temporary work directory, and at most
+    `io_jobs` mkvextract/mkvmerge runs happen at once.
+    Returns a report with the episode number, result and time per file.
+    """
+    import glob
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    from . import EpisodeNotFound
+    from .util import get_episode_number
+
+    if os.path.isdir(source):
+        files = sorted(glob.glob(os.path.join(glob.escape(source), "*.mkv")))
+    else:
+        files = sorted(glob.glob(source))
+    files = [f for f in files if not f.endswith("_fixed.mkv")]
+
+    episodes: Dict[str, str] = {}
+    unnumbered: List[Dict] = []
+    for f in files:
+        try:
+            episodes[f] = get_episode_number(os.path.basename(f))
+        except EpisodeNotFound:
+            error = "no episode number in file name"
+            unnumbered.append(
+                dict(file=f, episode=None, ok=False, error=error, seconds=0.0)
+            )
+    files = list(episodes)
+
+    seen: Dict[str, str] = {}
+    for f, ep in episodes.items():
+        if ep in seen:
+            raise ValueError(
+                f"crunchy_unroll_batch: {seen[ep]} and {f} both parse as episode {ep}"
+            )
+        seen[ep] = f
+
+    slots = multiprocessing.Semaphore(io_jobs)
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_io_slots, initargs=(slots,)
+    ) as pool:
+        futures = [
+            pool.submit(_unroll_episode, f, styles, resolution, episodes[f])
+            for f in files
+        ]
+        report = [future.result() for future in futures]
+
+    for r in report:
+        status = "done" if r["ok"] else f"failed ({r['error']})"
+        print(f"Episode {r['episode']}: {status} in {r['seconds']:.2f}s")
+    for r in unnumbered:
+        print(f"{r['file']}: skipped ({r['error']})")
+    report += unnumbered
+
+    return report
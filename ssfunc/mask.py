@@ -1,5 +1,8 @@
 import vapoursynth as vs
 from enum import Enum
+from typing import Dict
+
+from . import plugins
 
 core = vs.core
 
@@ -10,7 +13,13 @@ class Mode(Enum):
 
 
 def retinex_linemask(
-    clip: vs.VideoNode, sigma: float = 1, scale: float = 1, mode: Mode = Mode.KIRSCH
+    clip: vs.VideoNode,
+    sigma: float = 1,
+    scale: float = 1,
+    mode: Mode = Mode.KIRSCH,
+    adaptive: bool = False,
+    brightness: float = 0.25,
+    report: Dict[str, int] = None,
 ) -> vs.VideoNode:
     """
     Use retinex to greatly improve the accuracy of the edge detection in dark scenes.
@@ -20,36 +29,73 @@ def retinex_linemask(
         – 1: Uses Varde's fixed Kirsch mask.
         – 2: Uses FDOG for line detection and Extended Laplace for catching particles.
 
-    :param clip:    Input clip
-    :param sigma:   Sigma value for TCanny
-    :param scale:   Multiplication factor
-    :param mode:    Mask to be be used
+    The scaling and all of the mask additions are done in a single
+    expression (akarin.Expr if available, std.Expr otherwise).
+
+    With `adaptive=True`, the average luma of every frame is measured on a
+    downscaled copy, and the expensive retinex + TCanny branch is only run
+    on frames darker than `brightness`. Brighter frames get the plain
+    Kirsch/FDOG mask. Pass a dict as `report` to have it count how many
+    frames took each path (`"retinex"` and `"plain"`) as they're rendered.
+
+    :param clip:        Input clip
+    :param sigma:       Sigma value for TCanny
+    :param scale:       Multiplication factor
+    :param mode:        Mask to be be used
+    :param adaptive:    Only use retinex on dark frames
+    :param brightness:  Average luma (0-1) below which a frame is considered dark
+    :param report:      Optional dict to count frames per path in
 
     """
+    from functools import partial
     from vsutil import get_y
     from vsmask.edge import FDoG, ExLaplacian1, Kirsch
 
+    try:
+        mode = Mode(mode)
+    except ValueError:
+        print("Invalid `mode` used.")
+        return
+
     luma = get_y(clip)
     ret = core.retinex.MSRCP(luma, sigma=[50, 200, 350], upper_thr=0.005)
     tcanny = ret.tcanny.TCanny(mode=1, sigma=sigma).std.Minimum(
         coordinates=2 * [1, 0] + 2 * [0, 1]
     )
 
-    if mode == 1:
-        if scale == 1:
-            mask = get_y(Kirsch().edgemask(clip))
-        else:
-            mask = get_y(Kirsch().edgemask(clip)).std.Expr(f"x {scale} *")
-        return core.std.Expr([mask, tcanny], "x y +")
-    elif mode == 2:
-        if scale == 1:
-            fdm = get_y(FDoG().edgemask(clip))
-        else:
-            fdm = get_y(FDoG().edgemask(clip)).std.Expr(f"x {scale} *")
-
-        exlap = get_y(ExLaplacian1().edgemask(clip))
-        mask = core.std.Expr([fdm, exlap], "x y +")
-
-        return core.std.Expr([mask, tcanny], "x y +")
+    scaled = "x" if scale == 1 else f"x {scale} *"
+
+    if mode == Mode.KIRSCH:
+        edges = [get_y(Kirsch().edgemask(clip))]
+        expr = scaled
     else:
-        print("Invalid `mode` used.")
+        edges = [get_y(FDoG().edgemask(clip)), get_y(ExLaplacian1().edgemask(clip))]
+        expr = f"{scaled} y +"
+
+    tcanny_var = "y" if len(edges) == 1 else "z"
+    expr_engine = plugins.get("expr")
+
+    # all terms are non-negative, so clamping once at the end gives the same
+    # result as clamping after every step
+    full = expr_engine(edges + [tcanny], f"{expr} {tcanny_var} +")
+
+    if not adaptive:
+        return full
+
+    plain = expr_engine(edges, expr) if expr != "x" else edges[0]
+
+    stats = luma.resize.Bilinear(
+        max(luma.width // 8, 1), max(luma.height // 8, 1)
+    ).std.PlaneStats()
+
+    if report is not None:
+        report.setdefault("retinex", 0)
+        report.setdefault("plain", 0)
+
+    def _route(n: int, f: vs.VideoFrame, report: Dict[str, int]) -> vs.VideoNode:
+        dark = f.props["PlaneStatsAverage"] < brightness
+        if report is not None:
+            report["retinex" if dark else "plain"] += 1
+        return full if dark else plain
+
+    return plain.std.FrameEval(partial(_route, report=report), prop_src=stats)
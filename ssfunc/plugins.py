@@ -0,0 +1,99 @@
+import vapoursynth as vs
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+core = vs.core
+
+
+# Backends per operation, fastest first
+BACKENDS: Dict[str, List[Tuple[str, str]]] = {
+    "bilateral": [("bilateralgpu", "Bilateral"), ("bilateral", "Bilateral")],
+    "eedi3": [("eedi3m", "EEDI3CL"), ("eedi3m", "EEDI3")],
+    "nnedi3": [("nnedi3cl", "NNEDI3CL"), ("nnedi3", "nnedi3")],
+    "expr": [("akarin", "Expr"), ("std", "Expr")],
+    "source": [("lsmas", "LWLibavSource"), ("ffms2", "Source")],
+    "deband": [("placebo", "Deband"), ("neo_f3kdb", "Deband"), ("f3kdb", "Deband")],
+}
+
+_functions: Dict[int, Dict[str, Set[str]]] = {}
+
+
+def _env_id() -> int:
+    return vs.get_current_environment().env_id
+
+
+def functions() -> Dict[str, Set[str]]:
+    """
+    Returns the functions of every loaded plugin, by namespace.
+    `core` is only queried once per VapourSynth environment.
+
+    :rtype:     Dict[str, Set[str]]
+
+    """
+    env = _env_id()
+    if env not in _functions:
+        try:
+            found = {
+                p.namespace: {f.name for f in p.functions()} for p in core.plugins()
+            }
+        except AttributeError:
+            # API3 (pre-R55)
+            found = {
+                p["namespace"]: set(p["functions"]) for p in core.get_plugins().values()
+            }
+        _functions[env] = found
+    return _functions[env]
+
+
+def has(namespace: str, function: str = None) -> bool:
+    """
+    Checks if a plugin (and optionally one of its functions) is available.
+
+    :param namespace:   Plugin namespace, e.g. `akarin`
+    :param function:    Function name, e.g. `Expr`
+    :rtype:             bool
+
+    """
+    funcs = functions().get(namespace)
+    if funcs is None:
+        return False
+    return function is None or function in funcs
+
+
+def backend(op: str) -> Optional[Tuple[str, str]]:
+    """
+    Returns the fastest available `(namespace, function)` for an operation
+    in `BACKENDS`, or None if none of them are available.
+
+    :param op:      Operation, e.g. `expr` or `bilateral`
+    :rtype:         Optional[Tuple[str, str]]
+
+    """
+    for namespace, function in BACKENDS[op]:
+        if has(namespace, function):
+            return namespace, function
+    return None
+
+
+def get(op: str) -> Callable:
+    """
+    Returns the fastest available plugin function for an operation.
+
+    :param op:      Operation, e.g. `expr` or `bilateral`
+    :rtype:         Callable
+
+    """
+    found = backend(op)
+    if found is None:
+        raise vs.Error(
+            f"ssfunc: No plugin available for {op}, install one of: "
+            + ", ".join(f"{ns}.{fn}" for ns, fn in BACKENDS[op])
+        )
+    namespace, function = found
+    return getattr(getattr(core, namespace), function)
+
+
+def clear():
+    """
+    Forgets every probed environment, e.g. after loading plugins manually.
+    """
+    _functions.clear()
@@ -0,0 +1,302 @@
+import os
+import re
+import subprocess
+import vapoursynth as vs
+from bisect import bisect_left
+from typing import Dict, List, Tuple, Union
+
+from .util import normalise_ranges
+
+core = vs.core
+
+
+def scene_changes(
+    clip: vs.VideoNode,
+    threshold: float = 0.15,
+    downscale: int = 8,
+    prefetch: int = None,
+) -> List[int]:
+    """
+    Cheap scene change detection, for aligning render chunks to scenes.
+    Returns the frames whose downscaled 8-bit luma differs from the previous
+    frame's by more than `threshold` (PlaneStatsDiff).
+
+    Run it on the source rather than the filtered clip, it's much faster
+    and the scene changes are the same.
+
+    :param clip:        Input clip
+    :param threshold:   PlaneStatsDiff threshold, between 0 and 1
+    :param downscale:   Downscale factor for the luma
+    :param prefetch:    Number of frames in flight, defaults to `core.num_threads`
+    :rtype:             List[int]
+    """
+    from vsutil import get_y
+
+    small = get_y(clip).resize.Bilinear(
+        max(clip.width // downscale, 1),
+        max(clip.height // downscale, 1),
+        format=vs.GRAY8,
+    )
+    stats = small.std.PlaneStats(small[0] + small)
+
+    return [
+        n
+        for n, f in enumerate(stats.frames(prefetch=prefetch))
+        if n and f.props["PlaneStatsDiff"] > threshold
+    ]
+
+
+def split_chunks(
+    num_frames: int,
+    chunk_size: int = 1000,
+    scenes: List[int] = None,
+    ranges: List[Union[int, Tuple[int, int]]] = None,
+) -> List[Tuple[int, int]]:
+    """
+    Splits a clip into inclusive `(start, end)` chunks of roughly `chunk_size`
+    frames. With `scenes`, every cut is moved to the scene change closest to
+    `chunk_size` frames in, so every chunk starts on a new scene.
+    `ranges` (normalised as in `util.output_ranges`) limits the chunks to
+    those frames; a chunk never spans two ranges.
+
+    :param num_frames:  Number of frames in the clip
+    :param chunk_size:  Target chunk length
+    :param scenes:      First frames of every scene
+    :param ranges:      Frame numbers and/or inclusive `(start, end)` ranges to split
+    :rtype:             List[Tuple[int, int]]
+    """
+    if ranges is None:
+        ranges = [(0, num_frames - 1)]
+    ranges = normalise_ranges(ranges, num_frames, "split_chunks")
+    scenes = sorted(set(scenes or []))
+
+    chunks = []
+    for start, end in ranges:
+        while start <= end:
+            cut = start + chunk_size
+            if scenes:
+                i = bisect_left(scenes, cut)
+                candidates = [s for s in scenes[max(i - 1, 0) : i + 1] if s > start]
+                if candidates:
+                    cut = min(candidates, key=lambda s: abs(s - start - chunk_size))
+            cut = min(cut, end + 1)
+            chunks.append((start, cut - 1))
+            start = cut
+    return chunks
+
+
+def _load_output(script: str, output: int, script_args: Dict[str, str] = None):
+    """
+    Evaluates a VapourSynth script the way vspipe does and returns one of its outputs.
+    """
+    import runpy
+
+    runpy.run_path(
+        script, init_globals=dict(script_args or {}), run_name="__vapoursynth__"
+    )
+    node = vs.get_output(output)
+    # API4 returns a VideoOutputTuple
+    return getattr(node, "clip", node)
+
+
+def _render_chunk(
+    script: str,
+    output: int,
+    script_args: Dict[str, str],
+    threads: int,
+    encoder: List[str],
+    start: int,
+    end: int,
+    path: str,
+) -> Tuple[int, int]:
+    """
+    Process pool worker for `render`. Renders frames `start` to `end` of the
+    script's output to `path`, through a `.part` file so a crash never leaves
+    a chunk that looks complete.
+    """
+    clip = _load_output(script, output, script_args)
+    if threads is not None:
+        core.num_threads = threads
+
+    clip = clip[start : end + 1]
+    part = f"{path}.part"
+
+    if encoder is None:
+        with open(part, "wb") as f:
+            clip.output(f, y4m=True)
+    else:
+        cmd = [
+            arg.replace("{output}", part).replace("{frames}", str(clip.num_frames))
+            for arg in encoder
+        ]
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+        try:
+            clip.output(proc.stdin, y4m=True)
+        finally:
+            proc.stdin.close()
+        if proc.wait() != 0:
+            raise RuntimeError(f"{cmd[0]} exited with code {proc.returncode}")
+
+    os.replace(part, path)
+    return start, end
+
+
+_chunk_name = re.compile(r"^[0-9]{7}-[0-9]{7}\.[^.]+(\.part)?$")
+
+
+def _clear_chunks(workdir: str):
+    """
+    Deletes the chunks and signature `render` wrote to `workdir`, and nothing else.
+    """
+    for name in os.listdir(workdir):
+        if name == "signature.json" or _chunk_name.match(name):
+            os.remove(os.path.join(workdir, name))
+
+
+def _concat_chunks(paths: List[str], outfile: str, y4m: bool):
+    """
+    Concatenates the chunks in order. Y4M chunks after the first have their
+    stream header dropped, elementary streams are joined as they are.
+    """
+    import shutil
+
+    with open(outfile, "wb") as out:
+        for i, path in enumerate(paths):
+            with open(path, "rb") as f:
+                if y4m and i:
+                    f.readline()
+                shutil.copyfileobj(f, out, 16 << 20)
+
+
+def render(
+    script: str,
+    outfile: str,
+    output: int = 0,
+    workers: int = None,
+    threads: int = None,
+    chunk_size: int = 1000,
+    scenes: Union[List[int], vs.VideoNode] = None,
+    ranges: List[Union[int, Tuple[int, int]]] = None,
+    encoder: List[str] = None,
+    ext: str = None,
+    workdir: str = None,
+    script_args: Dict[str, str] = None,
+    keep: bool = False,
+) -> str:
+    """
+    Renders a script's output in parallel chunks and joins them, for filter
+    chains where a single vspipe → encoder pipe can't use every core.
+
+    The frame range (or `ranges`) is split with `split_chunks`, and every
+    chunk is rendered by its own worker process, which evaluates the script
+    like vspipe does and runs with `core.num_threads = threads`. Without
+    `encoder`, chunks are lossless Y4M intermediates. With `encoder`, Y4M is
+    piped to that command, where `{output}` is replaced with the chunk path
+    and `{frames}` with its length, e.g.
+    `["x264", "--demuxer", "y4m", "--frames", "{frames}", "-o", "{output}", "-"]`.
+    The encoder has to write a raw elementary stream (`ext="264"`, `"265"`, ...)
+    so chunks can be joined byte for byte; pass `scenes` so every chunk
+    (and so every keyframe the encoder is forced to place) starts a scene.
+
+    Finished chunks are kept in `workdir` (`<outfile>.chunks` by default) and
+    reused when `render` is run again, so after a crash or a failed chunk
+    only missing chunks are rendered. The chunks are thrown away if the
+    script file or the render settings change, but not if something the
+    script imports does, so clear `workdir` yourself in that case. Only the
+    chunk files and `signature.json` are ever deleted from `workdir`, and the
+    directory itself only when it's the default one and left empty.
+
+    :param script:          Path to the VapourSynth script
+    :param outfile:         Path to the joined output
+    :param output:          Output index of the script to render
+    :param workers:         Number of worker processes, defaults to the number of CPUs
+    :param threads:         `core.num_threads` for every worker, defaults to the script's
+    :param chunk_size:      Target chunk length, in frames
+    :param scenes:          First frames of every scene, or a clip to run `scene_changes` on
+    :param ranges:          Only render these frames/ranges, as in `util.output_ranges`
+    :param encoder:         Command to pipe every chunk to, see above
+    :param ext:             Chunk file extension, defaults to `y4m` without `encoder`
+    :param workdir:         Directory to keep the chunks in
+    :param script_args:     Globals to set before evaluating the script, like `vspipe --arg`
+    :param keep:            Keep the chunks after joining them
+    :rtype:                 str
+    :returns:               `outfile`
+    """
+    import json
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from .cache import file_key
+
+    if ext is None:
+        if encoder is not None:
+            raise ValueError("render: ext is required with a custom encoder")
+        ext = "y4m"
+
+    if isinstance(scenes, vs.VideoNode):
+        scenes = scene_changes(scenes)
+
+    num_frames = _load_output(script, output, script_args).num_frames
+    chunks = split_chunks(num_frames, chunk_size, scenes, ranges)
+
+    default_workdir = workdir is None
+    workdir = workdir or f"{outfile}.chunks"
+    os.makedirs(workdir, exist_ok=True)
+
+    # chunks rendered with another script or other settings can't be reused
+    signature = json.dumps(
+        [file_key(script), output, script_args, encoder, ext], sort_keys=True
+    )
+    sigfile = os.path.join(workdir, "signature.json")
+    if os.path.exists(sigfile):
+        with open(sigfile) as f:
+            if f.read() != signature:
+                _clear_chunks(workdir)
+    with open(sigfile, "w") as f:
+        f.write(signature)
+
+    paths = [os.path.join(workdir, f"{s:07d}-{e:07d}.{ext}") for s, e in chunks]
+    todo = [(c, p) for c, p in zip(chunks, paths) if not os.path.exists(p)]
+    print(f"render: {len(chunks) - len(todo)}/{len(chunks)} chunks already done")
+
+    failed = []
+    # spawn, as a forked VapourSynth core isn't safe to use
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = {
+            pool.submit(
+                _render_chunk,
+                script,
+                output,
+                script_args,
+                threads,
+                encoder,
+                start,
+                end,
+                path,
+            ): (start, end)
+            for (start, end), path in todo
+        }
+        for future in as_completed(futures):
+            start, end = futures[future]
+            try:
+                future.result()
+                print(f"render: chunk {start}-{end} done")
+            except Exception as e:
+                failed.append((start, end))
+                print(f"render: chunk {start}-{end} failed ({e})")
+
+    if failed:
+        raise vs.Error(
+            f"render: {len(failed)} chunk(s) failed: "
+            + ", ".join(f"{s}-{e}" for s, e in sorted(failed))
+            + ". Run render again to retry them."
+        )
+
+    _concat_chunks(paths, outfile, y4m=encoder is None)
+
+    if not keep:
+        _clear_chunks(workdir)
+        if default_workdir and not os.listdir(workdir):
+            os.rmdir(workdir)
+
+    return outfile
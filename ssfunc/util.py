@@ -1,9 +1,19 @@
+import os
+import re
 import vapoursynth as vs
+from functools import lru_cache
 from typing import Union, List, Tuple, cast
 
+from . import plugins
+from .cache import SourceCache, index_file
 
 core = vs.core
 
+src_cache = SourceCache(16)
+
+_episode_re = re.compile(r"(\b|E|_)([0-9]{1,3})(\b|_|v)")
+_digits_re = re.compile(r"([0-9]{1,3})")
+
 
 def get_episode_number(infile: str = None, zfill: int = 2, final: int = None):
     """
@@ -16,13 +26,14 @@ def get_episode_number(infile: str = None, zfill: int = 2, final: int = None):
     :rtype:         str
 
     """
-    import re
     from . import EpisodeNotFound
 
     if infile is None:
         raise TypeError("`get_episode_number` requires a string input")
-    partial = re.search(r"(\b|E|_)([0-9]{1,3})(\b|_|v)", infile).group(0)
-    episode = re.search(r"([0-9]{1,3})", partial).group(0)
+    found = _episode_re.search(infile)
+    if found is None:
+        raise EpisodeNotFound
+    episode = _digits_re.search(found.group(0)).group(0)
 
     if final is not None:
         episode_int = int(episode)
@@ -71,7 +82,19 @@ def scale(value: float, peak: int):
     return betterround(value * peak / 255)
 
 
-def midval(val=Union[List, List[Tuple]]):
+def midval(val: Union[List[int], Tuple[int, int]]):
+    """
+    Returns the middle value of a list of frames, or of an inclusive
+    `(start, end)` range without building the list of frames in it.
+
+    :param val:     List of frame numbers or `(start, end)` range
+    :rtype:         int
+
+    """
+    if isinstance(val, tuple):
+        med = (val[0] + val[1]) / 2
+        return int(med) if med.is_integer() else betterround(med)
+
     from statistics import median
 
     return median(val) if median(val) % 2 == 0 else betterround(median(val))
@@ -79,25 +102,57 @@ def midval(val=Union[List, List[Tuple]]):
 
 def get_uv(clip: vs.VideoNode):
     """
-    Converts clip to 32 bit float, creates a blank luma clip,
-    and returns the UV planes merged with the blank luma.
-    Output clip is converted to input format.
+    Creates a blank luma plane the size of the chroma planes and returns it
+    merged with the UV planes of the input, at the input's bit depth.
+    The chroma planes aren't converted or resampled, so the output is
+    the 4:4:4 equivalent of the input format at chroma resolution.
 
     :param clip:    Input clip
     :rtype:         vs.VideoNode
     :returns:       Merge of Chroma planes from input clip
 
     """
+    fmt = clip.format
+    w = clip.width >> fmt.subsampling_w
+    h = clip.height >> fmt.subsampling_h
+
+    t_y = core.std.BlankClip(
+        clip,
+        w,
+        h,
+        format=fmt.replace(color_family=vs.GRAY, subsampling_w=0, subsampling_h=0).id,
+    )
+
+    return core.std.ShufflePlanes(
+        [t_y, clip, clip], planes=[0, 1, 2], colorfamily=vs.YUV
+    )
+
+
+def get_uv_planes(clip: vs.VideoNode) -> Tuple[vs.VideoNode, vs.VideoNode]:
+    """
+    Returns the U and V planes of a clip as a pair of GRAY clips,
+    e.g. for building chroma masks.
 
-    clip = clip.fmtc.bitdepth(bits=32)
-    t_y = core.std.BlankClip(clip, 960, 540)
+    :param clip:    Input clip
+    :rtype:         Tuple[vs.VideoNode, vs.VideoNode]
 
-    return core.std.ShufflePlanes([t_y, clip], planes=[0, 1, 2]).resize.Point(
-        format="vs." + clip.format.name
+    """
+    return (
+        core.std.ShufflePlanes(clip, planes=1, colorfamily=vs.GRAY),
+        core.std.ShufflePlanes(clip, planes=2, colorfamily=vs.GRAY),
     )
 
 
-def desync(clipa: vs.VideoNode, clipb: vs.VideoNode, start: int = 0):
+def desync(
+    clipa: vs.VideoNode,
+    clipb: vs.VideoNode,
+    start: int = 0,
+    threshold: float = 0.15,
+    scan: bool = False,
+    prefetch: int = None,
+    cache=None,
+    block: int = 500,
+):
     """
     Function to check the `PlaneStatsDiff` value of two clips
     in order to find desync points between the clips.
@@ -111,64 +166,510 @@ def desync(clipa: vs.VideoNode, clipb: vs.VideoNode, start: int = 0):
     fixed desyncs upto frame 8100, set `start=8100`. That'll save time
     since the function won't run on frames which have already been checked.
 
-    :param clipa:   Master clip
-    :type clipa:    vs.VideoNode
-    :param clipb:   Desynced clip
-    :type clipb:    vs.VideNode
-    :param start:   Frame to start checking from
-    :rtype:         None
+    With `scan=True` the whole clip is checked in one pass, with up to
+    `prefetch` frames requested in parallel, and every desync region is
+    returned instead of stopping at the first one.
+
+    Passing an `ssfunc.cache.StatsCache` as `cache` stores every diff on disk,
+    so reruns only decode frames that haven't been checked before. Both clips
+    are fingerprinted every `block` frames (`cache.block_fingerprints`), so
+    after trimming `clipb` at frame 8100 only the diffs from the block before
+    the trim onwards are recomputed; changing either clip's format or size
+    recomputes everything.
+
+    :param clipa:       Master clip
+    :type clipa:        vs.VideoNode
+    :param clipb:       Desynced clip
+    :type clipb:        vs.VideNode
+    :param start:       Frame to start checking from
+    :param threshold:   `PlaneStatsDiff` value above which a frame is considered desynced
+    :param scan:        Scan the whole clip and return all desync regions
+    :param prefetch:    Number of frames in flight in scan mode, defaults to `core.num_threads`
+    :param cache:       Optional `ssfunc.cache.StatsCache` for `PlaneStatsDiff` values
+    :param block:       Fingerprint block size for `cache`, in frames
+    :rtype:             None or List[Tuple[int, int, float]]
+    :returns:           In scan mode, a list of `(start, end, max_diff)` desync regions
 
     """
     stats = core.std.PlaneStats(clipa, clipb)
 
+    key = blocks = None
+    if cache is not None:
+        import numpy as np
+        from .cache import block_fingerprints, clip_format_key
+
+        key = f"{clip_format_key(clipa)}|{clip_format_key(clipb)}"
+        blocks = np.hstack(
+            [
+                block_fingerprints(clipa, block),
+                block_fingerprints(clipb, block, stats.num_frames),
+            ]
+        )
+
+    if scan:
+        return _desync_scan(
+            stats, start, threshold, prefetch, cache, key, blocks, block
+        )
+
+    if cache is not None:
+        cache.open(stats.num_frames, key, blocks, block)
+
     for i in range(start, stats.num_frames):
         print(f"Checking Frames: {i}/{stats.num_frames} frames", end="\r")
-        diff = stats.get_frame(i).props["PlaneStatsDiff"]
-        if diff > 0.150000:
+        diff = None if cache is None else cache.get(i)
+        if diff is None:
+            diff = stats.get_frame(i).props["PlaneStatsDiff"]
+            if cache is not None:
+                cache.set(i, diff)
+        if diff > threshold:
             print(f"desync detected at >>{i}<<")
             break
 
+    if cache is not None:
+        cache.flush()
 
-def lehmer_merge(clips: List, radius: int = 3, passes: int = 2):
-    from vsutil import EXPR_VARS
 
-    blur = [
+def _desync_scan(
+    stats: vs.VideoNode,
+    start: int,
+    threshold: float,
+    prefetch: int = None,
+    cache=None,
+    key: str = None,
+    blocks=None,
+    block: int = None,
+) -> List[Tuple[int, int, float]]:
+    """
+    Parallel full-clip pass for `desync`. Frames are requested through
+    `frames()`, which keeps a bounded window of `prefetch` frames in flight
+    while still handing them back in order.
+    """
+    import numpy as np
+    from time import perf_counter
+
+    total = stats.num_frames - start
+
+    t0 = perf_counter()
+    if cache is not None:
+        diffs = cache.values(
+            stats, start, prefetch=prefetch, key=key, blocks=blocks, block=block
+        )
+    else:
+        diffs = np.empty(total, dtype=np.float64)
+        for i, f in enumerate(stats[start:].frames(prefetch=prefetch)):
+            diffs[i] = f.props["PlaneStatsDiff"]
+            if i % 100 == 0:
+                print(
+                    f"Checking Frames: {i + start}/{stats.num_frames} frames", end="\r"
+                )
+    elapsed = perf_counter() - t0
+
+    # group consecutive frames over the threshold into regions
+    over = np.concatenate(([False], diffs > threshold, [False]))
+    edges = np.flatnonzero(np.diff(over.astype(np.int8)))
+    regions: List[Tuple[int, int, float]] = [
+        (int(s) + start, int(e) - 1 + start, float(diffs[s:e].max()))
+        for s, e in zip(edges[::2], edges[1::2])
+    ]
+
+    print(
+        f"Checked {total} frames in {elapsed:.2f}s "
+        f"({total / elapsed if elapsed else 0:.2f} fps), "
+        f"{len(regions)} desync region(s) found"
+    )
+    for s, e, d in regions:
+        print(f"desync detected at >>{s}-{e}<< (max diff {d:.4f})")
+
+    return regions
+
+
+def _fingerprints(
+    clip: vs.VideoNode, width: int = 32, height: int = 18, prefetch: int = None
+):
+    """
+    Downsizes `clip` to tiny float luma thumbnails and returns a
+    `(num_frames, width * height)` array of zero-mean, unit-length
+    fingerprints, so that a dot product is the normalised correlation.
+    """
+    import numpy as np
+    from vsutil import get_y
+
+    thumb = get_y(clip).resize.Bilinear(width, height, format=vs.GRAYS)
+    prints = np.empty((thumb.num_frames, width * height), dtype=np.float32)
+
+    for i, f in enumerate(thumb.frames(prefetch=prefetch)):
+        prints[i] = np.asarray(f[0]).ravel()
+
+    prints -= prints.mean(axis=1, keepdims=True)
+    norm = np.linalg.norm(prints, axis=1, keepdims=True)
+    prints /= np.where(norm == 0, 1, norm)
+    return prints
+
+
+def _frame_similarity(x, y, start: int, end: int, offset: int):
+    """
+    Per-frame correlation of `x[start:end]` against `y[start + offset:end + offset]`.
+    Frames that fall outside of `y` score -1.
+    """
+    import numpy as np
+
+    idx = np.arange(start, end) + offset
+    valid = (idx >= 0) & (idx < len(y))
+    out = np.full(end - start, -1.0, dtype=np.float32)
+    out[valid] = np.einsum("ij,ij->i", x[start:end][valid], y[idx[valid]])
+    return out
+
+
+def _split_point(x, y, start: int, end: int, old: int, new: int) -> int:
+    """
+    Finds the first frame in `x[start:end]` that should use the `new` offset
+    instead of the `old` one, maximising the total correlation on both sides.
+    """
+    import numpy as np
+
+    before = np.concatenate(([0], np.cumsum(_frame_similarity(x, y, start, end, old))))
+    after = _frame_similarity(x, y, start, end, new)
+    after = after.sum() - np.concatenate(([0], np.cumsum(after)))
+    return start + int(np.argmax(before + after))
+
+
+def find_sync_map(
+    clipa: vs.VideoNode,
+    clipb: vs.VideoNode,
+    segment: int = 240,
+    max_offset: int = 120,
+    min_score: float = 0.8,
+    width: int = 32,
+    height: int = 18,
+    prefetch: int = None,
+) -> List[Tuple[str, int, int]]:
+    """
+    Estimates the frame offset between two clips and returns a sync map
+    that can be passed to `apply_sync_map` to sync `clipb` to `clipa`.
+    Meant to replace repeated `desync` runs when syncing Wakanim/BiliBili
+    sources to Funimation video.
+
+    Both clips are downsized to tiny luma thumbnails in a single pass, and
+    the offset of every `segment` frames of `clipa` is found by correlating
+    its fingerprints against `clipb` for every offset up to `max_offset`.
+    Segments that don't match anything well (black frames, flat title cards)
+    keep the previous offset. Where the offset changes, the exact frame is
+    found by comparing per-frame correlations on both sides of the change.
+
+    The sync map is a list of `(op, frame, count)` tuples in `clipb` frame
+    numbers, where `op` is either `"drop"` (remove `count` frames starting
+    at `frame`) or `"insert"` (insert `count` frames before `frame`).
+
+    Limits: every segment gets a single offset, and only one offset change is
+    found between two neighbouring segments. Several drops/inserts within
+    `segment` frames of each other (or a desync that comes back within a
+    segment) are merged into one net change or missed, so lower `segment`
+    for sources like that, and check the result with `desync`.
+
+    :param clipa:       Master clip
+    :param clipb:       Desynced clip
+    :param segment:     Number of frames of `clipa` per offset estimate
+    :param max_offset:  Largest offset, in frames, to search for
+    :param min_score:   Minimum mean correlation for a segment's offset to be trusted
+    :param width:       Thumbnail width
+    :param height:      Thumbnail height
+    :param prefetch:    Number of frames in flight, defaults to `core.num_threads`
+    :rtype:             List[Tuple[str, int, int]]
+    :returns:           Sync map for `clipb`
+
+    """
+    import numpy as np
+
+    a = _fingerprints(clipa, width, height, prefetch)
+    b = _fingerprints(clipb, width, height, prefetch)
+
+    offsets = np.arange(-max_offset, max_offset + 1)
+    seg_starts = list(range(0, len(a), segment))
+    seg_offsets: List[int] = []
+    previous = 0
+
+    for s in seg_starts:
+        seg = a[s : s + segment]
+        lo = s - max_offset
+        hi = s + len(seg) + max_offset
+
+        window = np.zeros((hi - lo, b.shape[1]), dtype=np.float32)
+        valid = np.zeros(hi - lo, dtype=bool)
+        blo, bhi = max(lo, 0), min(hi, len(b))
+        if blo < bhi:
+            window[blo - lo : bhi - lo] = b[blo:bhi]
+            valid[blo - lo : bhi - lo] = True
+
+        # sim[i, j] is the correlation of seg[i] and window[j], so every
+        # offset is one diagonal of it
+        sim = seg @ window.T
+        rows = np.arange(len(seg))[:, None]
+        cols = rows + max_offset + offsets[None, :]
+        hits = valid[cols]
+        counts = hits.sum(axis=0)
+        scores = np.where(
+            counts > 0,
+            np.where(hits, sim[rows, cols], 0).sum(axis=0) / np.maximum(counts, 1),
+            -np.inf,
+        )
+
+        best = int(np.argmax(scores))
+        if scores[best] >= min_score:
+            previous = int(offsets[best])
+        seg_offsets.append(previous)
+
+    sync_map: List[Tuple[str, int, int]] = []
+
+    if seg_offsets and seg_offsets[0] > 0:
+        sync_map.append(("drop", 0, seg_offsets[0]))
+    elif seg_offsets and seg_offsets[0] < 0:
+        sync_map.append(("insert", 0, -seg_offsets[0]))
+
+    for k in range(1, len(seg_offsets)):
+        old, new = seg_offsets[k - 1], seg_offsets[k]
+        if old == new:
+            continue
+
+        start = seg_starts[k - 1]
+        end = min(seg_starts[k] + segment, len(a))
+
+        if new > old:
+            # clipb has extra frames, every frame of clipa still has a match
+            t = _split_point(a, b, start, end, old, new)
+            sync_map.append(("drop", t + old, new - old))
+        else:
+            # clipb is missing frames, so look at it from clipb's side instead
+            t = _split_point(
+                b, a, max(start + old, 0), min(end + new, len(b)), -old, -new
+            )
+            sync_map.append(("insert", t, old - new))
+
+    return sync_map
+
+
+def apply_sync_map(
+    clip: vs.VideoNode, sync_map: List[Tuple[str, int, int]], length: int = None
+) -> vs.VideoNode:
+    """
+    Applies a sync map from `find_sync_map` to a clip.
+    Inserted frames are copies of the frame before them.
+
+    :param clip:        Desynced clip
+    :param sync_map:    List of `(op, frame, count)` tuples
+    :param length:      Optionally trim or pad (with the last frame) the output to this many frames
+    :rtype:             vs.VideoNode
+    :returns:           Synced clip
+
+    """
+    # apply from the end so frame numbers of earlier entries stay valid
+    for op, frame, count in sorted(sync_map, key=lambda x: x[1], reverse=True):
+        if count <= 0:
+            continue
+        if op == "drop":
+            if frame <= 0 and frame + count >= clip.num_frames:
+                raise ValueError(
+                    f"apply_sync_map: Dropping {count} frames at {frame} "
+                    f"would leave nothing of a {clip.num_frames} frame clip"
+                )
+            parts = [clip[:frame]] if frame > 0 else []
+            if frame + count < clip.num_frames:
+                parts.append(clip[frame + count :])
+        elif op == "insert":
+            parts = [clip[:frame]] if frame > 0 else []
+            parts.append(clip[max(min(frame, clip.num_frames) - 1, 0)] * count)
+            if frame < clip.num_frames:
+                parts.append(clip[frame:])
+        else:
+            raise ValueError(f"apply_sync_map: Unknown operation: {op}")
+        clip = core.std.Splice(parts) if len(parts) > 1 else parts[0]
+
+    if length is not None:
+        if clip.num_frames > length:
+            clip = clip[:length]
+        elif clip.num_frames < length:
+            clip = clip + clip[-1] * (length - clip.num_frames)
+
+    return clip
+
+
+def lehmer_blur(clips: List[vs.VideoNode], radius: int = 3, passes: int = 2):
+    """
+    Blurred clips for `lehmer_merge`. Compute these once and pass them as
+    `blurs` to share them between repeated merges of the same clips.
+
+    :param clips:   Input clips
+    :param radius:  BoxBlur radius
+    :param passes:  BoxBlur passes
+    :rtype:         List[vs.VideoNode]
+
+    """
+    return [
         core.std.BoxBlur(
             i, hradius=radius, vradius=radius, hpasses=passes, vpasses=passes
         )
         for i in clips
     ]
 
-    count = len(clips)
-    iterations = range(count)
+
+@lru_cache(maxsize=None)
+def _lehmer_exprs(count: int) -> Tuple[str, str, str, str]:
+    """
+    Expressions for `count` clips followed by their `count` blurs: the full
+    merge, and the partial sums of cubed differences, squared differences
+    and blurs used to merge the clips in chunks.
+    """
+    from vsutil import EXPR_VARS
+
     clipvars = EXPR_VARS[:count]
-    blurvars = EXPR_VARS[count:]
-    expr = ""
+    blurvars = EXPR_VARS[count : count * 2]
+    adds = ["+"] * (count - 1)
+
+    diffs = [f"{c} {b} - D{i}!" for i, (c, b) in enumerate(zip(clipvars, blurvars))]
+    p1 = [f"D{i}@ 3 pow" for i in range(count)] + adds
+    p2 = [f"D{i}@ 2 pow" for i in range(count)] + adds
+    full = " ".join(
+        diffs
+        + p1
+        + ["P1!"]
+        + p2
+        + ["P2!", "P2@ 0 = 0 P1@ P2@ / ?"]
+        + list(blurvars)
+        + adds
+        + [f"{count} / +"]
+    )
+
+    def partial(power: int) -> str:
+        terms = [f"{c} {b} - {power} pow" for c, b in zip(clipvars, blurvars)]
+        return " ".join(terms + adds)
+
+    return full, partial(3), partial(2), " ".join(list(blurvars) + adds)
+
+
+def _sum_clips(clips: List[vs.VideoNode], fmt: int) -> vs.VideoNode:
+    """
+    Sums any number of clips with as few Expr calls as the variable limit allows.
+    """
+    from vsutil import EXPR_VARS
+
+    while len(clips) > 1:
+        clips = [
+            core.akarin.Expr(
+                group,
+                " ".join(
+                    [EXPR_VARS[0]] + [f"{v} +" for v in EXPR_VARS[1 : len(group)]]
+                ),
+                format=fmt,
+            )
+            for group in (
+                clips[i : i + len(EXPR_VARS)]
+                for i in range(0, len(clips), len(EXPR_VARS))
+            )
+        ]
+    return clips[0]
+
+
+def lehmer_merge(
+    clips: List[vs.VideoNode],
+    radius: int = 3,
+    passes: int = 2,
+    blurs: List[vs.VideoNode] = None,
+    chunk: int = 13,
+) -> vs.VideoNode:
+    """
+    Merges clips using the Lehmer mean of their differences to a blurred
+    copy of each clip, added back onto the mean of the blurs.
+
+    Any number of clips is supported: up to `chunk` clips are merged in a
+    single expression, and more are merged in chunks that carry the partial
+    sums of cubed and squared differences and of the blurs as float clips,
+    which are then combined into the same mean.
+
+    :param clips:   Input clips
+    :param radius:  BoxBlur radius
+    :param passes:  BoxBlur passes
+    :param blurs:   Precomputed blurs from `lehmer_blur`, one per clip
+    :param chunk:   Maximum clips per expression, limited by the available expression variables
+    :rtype:         vs.VideoNode
+
+    """
+    from vsutil import EXPR_VARS
+
+    if blurs is None:
+        blurs = lehmer_blur(clips, radius, passes)
+    if len(blurs) != len(clips):
+        raise ValueError("lehmer_merge: `blurs` must have one clip per input clip")
+
+    count = len(clips)
+    chunk = max(1, min(chunk, len(EXPR_VARS) // 2))
+
+    if count <= chunk:
+        return core.akarin.Expr(clips + blurs, _lehmer_exprs(count)[0])
+
+    fmt = clips[0].format.replace(sample_type=vs.FLOAT, bits_per_sample=32).id
+    p1s, p2s, sums = [], [], []
+    for i in range(0, count, chunk):
+        group = clips[i : i + chunk] + blurs[i : i + chunk]
+        _, p1, p2, blursum = _lehmer_exprs(len(group) // 2)
+        p1s.append(core.akarin.Expr(group, p1, format=fmt))
+        p2s.append(core.akarin.Expr(group, p2, format=fmt))
+        sums.append(core.akarin.Expr(group, blursum, format=fmt))
+
+    return core.akarin.Expr(
+        [_sum_clips(p1s, fmt), _sum_clips(p2s, fmt), _sum_clips(sums, fmt)],
+        f"y 0 = 0 x y / ? z {count} / +",
+        format=clips[0].format.id,
+    )
 
-    for i in iterations:
-        expr += f"{clipvars[i]} {blurvars[i]} - D{i}! "
 
-    for i in iterations:
-        expr += f"D{i}@ 3 pow "
-    expr += "+ " * (count - 1)
-    expr += "P1! "
+def normalise_ranges(
+    ranges: List[Union[int, Tuple[int, int]]], num_frames: int, func: str = "ranges"
+) -> List[Tuple[int, int]]:
+    """
+    Normalises a list of inclusive frame ranges, in the same format as
+    fvsfunc.ReplaceFrames, into sorted `(start, end)` tuples with
+    overlapping and adjacent ranges merged. Every range is bounds-checked.
 
-    for i in iterations:
-        expr += f"D{i}@ 2 pow "
-    expr += "+ " * (count - 1)
-    expr += "P2! "
+    :param ranges:      Frame numbers and/or inclusive `(start, end)` ranges
+    :param num_frames:  Number of frames in the clip the ranges refer to
+    :param func:        Name used in error messages
+    :rtype:             List[Tuple[int, int]]
 
-    expr += "P2@ 0 = 0 P1@ P2@ / ? "
+    """
+    parsed = []
+    for r in ranges:
+        if isinstance(r, (tuple, list)):
+            start, end = cast(Tuple[int, int], r)
+        else:
+            start = end = cast(int, r)
 
-    for i in iterations:
-        expr += f"{blurvars[i]} "
-    expr += "+ " * (count - 1)
-    expr += f"{count} / +"
+        if start > end:
+            raise ValueError(
+                "{}: Start frame is bigger than end frame: [{} {}]".format(
+                    func, start, end
+                )
+            )
+        if start < 0:
+            raise ValueError("{}: Negative start frame: {}".format(func, start))
+        if end >= num_frames:
+            raise ValueError(
+                "{}: End frame too big, one of the clips has less frames: {}".format(
+                    func, end
+                )
+            )
+        parsed.append((start, end))
 
-    return core.akarin.Expr(clips + blur, expr)
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(parsed):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
 
 
-def output_ranges(clip: vs.VideoNode, ranges: str = None) -> vs.VideoNode:
+def output_ranges(
+    clip: vs.VideoNode, ranges: List[Union[int, Tuple[int, int]]] = None
+) -> vs.VideoNode:
     """
     Simple modification of fvsfunc.ReplaceFrames() that returns ranges
     of input clips rather than replacing them with a different clip.
@@ -182,6 +683,10 @@ def output_ranges(clip: vs.VideoNode, ranges: str = None) -> vs.VideoNode:
     any ranges (i.e. what would pass through `clipa` in rfs) will throw
     an error here.
 
+    Ranges are sorted, and overlapping or adjacent ranges are merged, so
+    every frame is output once and in order. The output is built with a
+    single `std.Splice`, so the graph stays flat however many ranges there are.
+
     Original function by EoE, modified by SeaSmoke to lvsfunc.ReplaceFrames
     format.
 
@@ -194,53 +699,116 @@ def output_ranges(clip: vs.VideoNode, ranges: str = None) -> vs.VideoNode:
     if not isinstance(clip, vs.VideoNode):
         raise TypeError('OutputFrames: "clipa" must be a clip!')
 
-    for r in ranges:
-        if type(r) is tuple:
-            start, end = cast(Tuple[int, int], r)
-        else:
-            start = cast(int, r)
-            end = cast(int, r)
-
-    if start > end:
-        raise ValueError(
-            "OutputFrames: Start frame is bigger than end frame: [{} {}]".format(
-                start, end
-            )
-        )
-    if end >= clip.num_frames:
-        raise ValueError(
-            "OutputFrames: End frame too big, one of the clips has less frames: {}".format(
-                end
-            )
-        )
+    ranges = normalise_ranges(ranges or [], clip.num_frames, "OutputFrames")
+    if not ranges:
+        raise ValueError("OutputFrames: No ranges to output!")
 
-    # create clip with with tempory frame at the start as zero length clips aren't allowed by vs
-    out = core.std.BlankClip(clip, length=1)
-    for start, end in ranges:
-        out = out + clip[start : end + 1]
-    # remember to remove our tempory frame
-    return out[1:]
+    clips = [clip[start : end + 1] for start, end in ranges]
+    return clips[0] if len(clips) == 1 else core.std.Splice(clips)
 
 
-def src(path: str, force_ffms2: bool = False, image: bool = False, **indexer_args) -> vs.VideoNode:
+def src(
+    path: str,
+    force_ffms2: bool = False,
+    image: bool = False,
+    index_cache: bool = True,
+    reuse: bool = True,
+    **indexer_args,
+) -> vs.VideoNode:
     """
     Wrapper for core.ffms2.Source() and core.lsmas.LWLibavSource().
 
+    Index files for lsmas and ffms2 are kept in ssfunc's managed index cache
+    (see `ssfunc.cache.index_file`), keyed by file content, so they aren't
+    written next to the source or rebuilt when it's moved. Passing
+    `cachefile` yourself overrides this.
+
+    Loaded nodes are kept in `util.src_cache`, an LRU cache keyed by path,
+    indexer and indexer arguments, so loading the same file again reuses
+    the same decoder. Use `src_cache.clear()` to drop them.
+
     :param path:            Path to video file
-    :param force_ffms2:     Force ffms2 over lsmas
+    :param force_ffms2:     Force ffms2 over lsmas (also used when lsmas isn't installed)
+    :param image:           Force imwri for image sequences
+    :param index_cache:     Use the managed index cache
+    :param reuse:           Reuse a previously loaded node for the same arguments
     :rtype:                 vs.VideoNode
     :returns:               Video clip
     """
+    from functools import partial
+
+    load = partial(_load_source, path, force_ffms2, image, index_cache, indexer_args)
+    if not reuse:
+        return load()
+
+    key = (
+        os.path.abspath(path),
+        force_ffms2,
+        image,
+        index_cache,
+        tuple(sorted((k, repr(v)) for k, v in indexer_args.items())),
+    )
+    return src_cache.get(key, load)
+
+
+def _load_source(
+    path: str, force_ffms2: bool, image: bool, index_cache: bool, indexer_args: dict
+) -> vs.VideoNode:
+    indexer_args = dict(indexer_args)
+    force_ffms2 = force_ffms2 or plugins.backend("source") == ("ffms2", "Source")
 
     if path.endswith('.jpg') or path.endswith('.png') or image is True:
         return core.imwri.Read(path, **indexer_args)
-    elif path.endswith('mp4'):
+    elif path.endswith('mp4') and not force_ffms2:
+        # LibavSMASHSource reads the mp4 index directly, there's nothing to cache
         return core.lsmas.LibavSMASHSource(path, **indexer_args)
     elif path.endswith('.d2v'):
         return core.d2v.Source(path, **indexer_args)
     elif path.endswith('.dgi'):
         return core.dgdecodenv.DGSource(path, **indexer_args)
     elif force_ffms2:
+        if index_cache and "cachefile" not in indexer_args:
+            indexer_args["cachefile"] = index_file(path, "ffindex")
         return core.ffms2.Source(path, **indexer_args)
     else:
+        if index_cache and "cachefile" not in indexer_args:
+            indexer_args["cachefile"] = index_file(path, "lwi")
         return core.lsmas.LWLibavSource(path, **indexer_args)
+
+
+def _index_worker(path: str, force_ffms2: bool, indexer_args: dict) -> str:
+    """
+    Process pool worker for `src_many`. Opening the source is enough
+    to build its index in the managed index cache.
+    """
+    src(path, force_ffms2=force_ffms2, reuse=False, **indexer_args)
+    return path
+
+
+def src_many(
+    paths: List[str], workers: int = None, force_ffms2: bool = False, **indexer_args
+) -> List[vs.VideoNode]:
+    """
+    Builds the indexes for many sources (e.g. a whole season) in parallel
+    worker processes, then loads them with `src`.
+
+    :param paths:           Paths to video files
+    :param workers:         Number of worker processes, defaults to the number of CPUs
+    :param force_ffms2:     Force ffms2 over lsmas
+    :rtype:                 List[vs.VideoNode]
+    :returns:               Video clips, in the same order as `paths`
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    # spawn, as a forked VapourSynth core isn't safe to use
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = [
+            pool.submit(_index_worker, path, force_ffms2, indexer_args)
+            for path in paths
+        ]
+        for future in futures:
+            future.result()
+
+    return [src(path, force_ffms2=force_ffms2, **indexer_args) for path in paths]